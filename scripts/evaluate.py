@@ -13,82 +13,117 @@ Outputs results to CSV for analysis.
 
 import argparse
 import csv
-import json
+import functools
+import logging
 import os
+import re
 import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+import numpy as np
+import orjson
+from tqdm import tqdm
 
 # Add src to path
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root / "src"))
 
 from imagesearch import index
-from imagesearch.embeddings import file_id
-from imagesearch.caption import describe_image, get_cached, put_cached
-from imagesearch.enhance import enhance_query
-from imagesearch.rerank import rerank_by_caption
+from imagesearch.embeddings import encode_texts_clip, file_id
+from imagesearch.caption import cached_keys, describe_image, get_cached, put_cached
+from imagesearch.enhance import (
+    enhance_query,
+    get_cached_enhancement,
+    save_enhanced_cache,
+    seed_enhancements,
+)
+from imagesearch.ratelimit import RateLimiter, gemini_limiter
+from imagesearch.rerank import blend_scores, score_components
 from imagesearch.config import DATA_DIR
 
+logger = logging.getLogger(__name__)
 
 # Paths
 QUERIES_PATH = DATA_DIR / "queries" / "queries.json"
-ENHANCED_CACHE_PATH = DATA_DIR / "queries" / "enhanced_cache.json"
+ENHANCED_FIXTURE_PATH = DATA_DIR / "queries" / "enhanced_cache.json"
 EVALUATION_DIR = DATA_DIR / "evaluation"
 EVALUATION_DIR.mkdir(parents=True, exist_ok=True)
 
+# CSV output buffering
+CSV_BUFFER_BYTES = 1 << 20
+CSV_ROWS_PER_WRITE = 256
+
+# Number of (model, enhancement, difficulty) cells evaluated concurrently
+EVAL_WORKERS = 8
+
 
 def load_queries() -> Dict[str, Any]:
     """Load queries from JSON file."""
-    with open(QUERIES_PATH, "r") as f:
-        return json.load(f)
+    with open(QUERIES_PATH, "rb") as f:
+        return orjson.loads(f.read())
 
 
-def load_enhanced_cache() -> Dict[str, str]:
-    """Load cached enhanced queries."""
-    if ENHANCED_CACHE_PATH.exists():
-        with open(ENHANCED_CACHE_PATH, "r") as f:
-            return json.load(f)
-    return {}
+def seed_enhanced_fixture(queries_data: Dict[str, Any]) -> None:
+    """
+    Load the checked-in enhanced queries into enhance_query's cache.
 
+    The fixture is keyed by query ID; entries are mapped to their query
+    text so runs reproduce the committed results without calling Gemini.
 
-def save_enhanced_cache(cache: Dict[str, str]) -> None:
-    """Save enhanced queries to cache."""
-    ENHANCED_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(ENHANCED_CACHE_PATH, "w") as f:
-        json.dump(cache, f, indent=2, ensure_ascii=False)
+    Args:
+        queries_data: Parsed queries.json
+    """
+    if not ENHANCED_FIXTURE_PATH.exists():
+        return
+    with open(ENHANCED_FIXTURE_PATH, "rb") as f:
+        fixture = orjson.loads(f.read())
+
+    entries = {
+        query_text: fixture[query_id]
+        for diff_data in queries_data.values()
+        for query_id, query_text in diff_data["queries"].items()
+        if fixture.get(query_id)
+    }
+    seeded = seed_enhancements(entries)
+    if seeded:
+        print(f"Loaded {seeded} enhanced queries from {ENHANCED_FIXTURE_PATH}")
 
 
-def get_enhanced_query(query_id: str, query_text: str, cache: Dict[str, str]) -> str:
+def get_enhanced_query(query_id: str, query_text: str) -> str:
     """
-    Get enhanced query, using cache if available.
+    Get enhanced query, reading through enhance_query's persistent cache.
 
     Args:
-        query_id: Query identifier (e.g., "eq1")
+        query_id: Query identifier (e.g., "eq1"), used for progress output
         query_text: Original query text
-        cache: Enhanced query cache
 
     Returns:
         Enhanced query text
     """
-    if query_id in cache:
-        return cache[query_id]
+    if get_cached_enhancement(query_text) is not None:
+        return enhance_query(query_text)
 
     print(f"  Enhancing query '{query_id}': {query_text}")
-    enhanced = enhance_query(query_text)
-    cache[query_id] = enhanced
-    save_enhanced_cache(cache)
+    enhanced = enhance_query(query_text, limiter=gemini_limiter)
     print(f"    → {enhanced}")
     return enhanced
 
 
-def get_caption_cached(path: str) -> str:
+# Caption cache keys, scanned once at the start of run_evaluation
+_cached_vids: Optional[Set[str]] = None
+
+
+def get_caption_cached(path: str, limiter: Optional[RateLimiter] = None) -> str:
     """
     Get caption for an image, using cache when available.
     Generates with Gemini if not cached.
 
     Args:
         path: Path to the image file (may be relative)
+        limiter: Rate limiter for the Gemini request, if one is made
 
     Returns:
         Image caption
@@ -97,22 +132,52 @@ def get_caption_cached(path: str) -> str:
     if not os.path.isabs(path):
         path = str(project_root / path)
 
-    # Check if file exists
-    if not os.path.exists(path):
+    # Memoized per file version, so unchanged images are only hashed once
+    try:
+        key = file_id(path)
+    except OSError:
         print(f"    Warning: File not found: {path}")
         return ""
 
-    key = file_id(path)
-    cap = get_cached(key)
-    if cap:
-        return cap
+    # Only read the cache for keys known to be there (when the key set is loaded)
+    if _cached_vids is None or key in _cached_vids:
+        cap = get_cached(key)
+        if cap:
+            return cap
 
     print(f"    Generating caption for: {path}")
-    cap, _ = describe_image(path)
+    cap, _ = describe_image(path, limiter=limiter)
     put_cached(key, cap)
+    if _cached_vids is not None:
+        _cached_vids.add(key)
     return cap
 
 
+def prewarm_captions(paths: List[str], max_workers: int = 16) -> None:
+    """
+    Fill the caption cache for several images concurrently.
+
+    Captions are generated by Gemini requests that mostly wait on the
+    network, so missing captions are fetched in parallel and later lookups
+    during reranking hit the cache.
+
+    Args:
+        paths: Image paths (may be relative)
+        max_workers: Maximum number of concurrent caption requests
+    """
+    paths = [p for p in dict.fromkeys(paths) if p]
+    if not paths:
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        # Bulk generation: keep within the Gemini request budget
+        list(ex.map(functools.partial(get_caption_cached, limiter=gemini_limiter), paths))
+
+
+# Last path component (either separator) without its extension
+_IMAGE_NAME_RE = re.compile(r"([^/\\]+?)(?:\.[^./\\]*)?$")
+
+
 def extract_image_name(path: str) -> str:
     """
     Extract image name from path.
@@ -125,57 +190,96 @@ def extract_image_name(path: str) -> str:
     Returns:
         Image name without extension
     """
-    basename = os.path.basename(path)
-    name, _ = os.path.splitext(basename)
-    return name
+    m = _IMAGE_NAME_RE.search(path)
+    # No last component (e.g. a trailing separator), as os.path.basename gives ""
+    return m.group(1) if m else ""
+
+
+def rerank_components(
+    query: str,
+    matches: List[Dict[str, Any]],
+    query_embedding: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, ...]:
+    """
+    Compute caption reranking scores for a list of matches.
+
+    Args:
+        query: Query text (original or enhanced)
+        matches: Pinecone matches for the query
+        query_embedding: Precomputed CLIP text embedding of the query
+
+    Returns:
+        Tuple of (orig_scores, caption_sims, captions) from rerank.score_components
+    """
+    prewarm_captions([m["metadata"].get("path", "") for m in matches])
+    return score_components(query, matches, get_caption_cached, query_embedding)
 
 
 def run_search(
     query: str,
-    k: int,
+    k_vals: List[int],
     model: str,
     alpha: float = 0.6,
-    expand: int = 3
-) -> List[str]:
+    expand: int = 3,
+    matches: List[Dict[str, Any]] = None,
+    components: Tuple[np.ndarray, ...] = None,
+    query_embedding: Optional[np.ndarray] = None
+) -> Dict[int, List[str]]:
     """
-    Run search with specified configuration.
+    Run search with specified configuration for several k values at once.
+
+    Retrieval and reranking happen once for the largest k. Each smaller k
+    reuses that ranking: a match's reranked score does not depend on the
+    other candidates, so reranking the first expand*k matches gives the
+    same order as filtering the full reranking down to those matches.
 
     Args:
         query: Query text (original or enhanced)
-        k: Number of results to return
+        k_vals: Numbers of results to return
         model: Model type ("clip" or "clip_rerank")
         alpha: Blend weight for reranking (only used if model="clip_rerank")
         expand: Expansion factor for initial retrieval
+        matches: Prefetched Pinecone matches for the query, at least
+            expand*max(k_vals) long. If None, Pinecone is queried directly.
+        components: Precomputed rerank.score_components() for a prefix-compatible
+            list of matches, shared between alpha values (only used if
+            model="clip_rerank")
+        query_embedding: Precomputed CLIP text embedding of the query
+            (only used if model="clip_rerank" and components is None)
 
     Returns:
-        List of image names (e.g., ["eq1_1", "eq1_2", ...])
+        Mapping of k to list of image names (e.g., {5: ["eq1_1", "eq1_2", ...]})
     """
-    # Fetch expand*k results from Pinecone
-    fetch_k = max(1, k * expand)
-    matches = index.search(query, fetch_k)
+    # Fetch expand*max_k results from Pinecone (or slice the prefetched list)
+    max_fetch_k = max(1, max(k_vals) * expand)
+    if matches is None:
+        matches = index.search(query, max_fetch_k)
+    else:
+        matches = matches[:max_fetch_k]
 
     if not matches:
-        return []
+        return {k: [] for k in k_vals}
 
-    # Apply reranking if needed
+    # Rank all candidates once, remembering each one's retrieval position
     if model == "clip_rerank":
-        reranked = rerank_by_caption(
-            query,
-            matches,
-            get_caption_cached,
-            alpha=alpha,
-            use_blend=True
-        )
-        # Take top k from reranked results
-        results = reranked[:k]
-        paths = [r["path"] for r in results]
+        if components is None:
+            components = rerank_components(query, matches, query_embedding)
+        orig, cap_sims = components[0][:len(matches)], components[1][:len(matches)]
+
+        # Same ordering as rerank_by_caption (stable, descending)
+        final = blend_scores(orig, cap_sims, alpha=alpha, use_blend=True)
+        order = np.argsort(-final, kind="stable")
+        ranked = [(i, matches[i]["metadata"].get("path", "")) for i in order]
     else:
-        # Just take top k from initial results
-        results = matches[:k]
-        paths = [m["metadata"].get("path", "") for m in results]
+        ranked = [(i, m["metadata"].get("path", "")) for i, m in enumerate(matches)]
 
-    # Extract image names
-    return [extract_image_name(p) for p in paths if p]
+    # For each k, keep candidates from the first expand*k matches and take top k
+    results = {}
+    for k in k_vals:
+        fetch_k = max(1, k * expand)
+        paths = [p for i, p in ranked if i < fetch_k][:k]
+        results[k] = [extract_image_name(p) for p in paths if p]
+    return results
 
 
 def run_evaluation(
@@ -193,9 +297,12 @@ def run_evaluation(
         models: List of models to evaluate (default: all)
         difficulties: List of difficulties to evaluate (default: all)
     """
-    # Load queries
+    global _cached_vids
+
+    # Load queries and the set of cached captions
     queries_data = load_queries()
-    enhanced_cache = load_enhanced_cache()
+    seed_enhanced_fixture(queries_data)
+    _cached_vids = cached_keys()
 
     # Default configurations
     if models is None:
@@ -217,80 +324,156 @@ def run_evaluation(
     # Enhancement settings
     enhancement_settings = [True, False]
 
-    # Open CSV for writing
-    with open(output_file, "w", newline="", encoding="utf-8") as f:
+    # Pass 1: resolve every query text that will be searched and the largest
+    # number of candidates it needs across all k values. All query
+    # enhancement happens here, so the cache is written once afterwards
+    # (also when interrupted) instead of after every new entry.
+    fetch_sizes: Dict[str, int] = {}
+    try:
+        for use_enhancement in enhancement_settings:
+            for difficulty in difficulties:
+                if difficulty not in queries_data:
+                    continue
+
+                diff_data = queries_data[difficulty]
+                fetch_k = max(1, max(diff_data["k_vals"]) * expand)
+
+                for query_id, query_text in diff_data["queries"].items():
+                    if use_enhancement:
+                        used_query = get_enhanced_query(query_id, query_text)
+                    else:
+                        used_query = query_text
+                    fetch_sizes[used_query] = max(fetch_sizes.get(used_query, 0), fetch_k)
+    finally:
+        save_enhanced_cache()
+
+    # Pass 2: retrieve candidates for all unique queries in one batch;
+    # the evaluation loops below only slice these lists locally
+    print(f"Fetching candidates for {len(fetch_sizes)} unique queries...")
+    prefetched = index.search_many(fetch_sizes)
+
+    # Encode every unique query for caption reranking in one batch
+    query_embeddings: Dict[str, np.ndarray] = {}
+    if "clip_rerank" in models and fetch_sizes:
+        texts = list(fetch_sizes)
+        query_embeddings = dict(zip(texts, encode_texts_clip(texts)))
+
+    # Pass 3: evaluate (model, enhancement, difficulty) cells in parallel.
+    # Cells share only read-mostly caches; rows are written in grid order.
+    cells = []
+    for model in models:
+        for use_enhancement in enhancement_settings:
+            for difficulty in difficulties:
+                if difficulty not in queries_data:
+                    print(f"Warning: Difficulty '{difficulty}' not found in queries")
+                    continue
+                cells.append((model, use_enhancement, difficulty))
+
+    def search_configs(
+        used_query: str,
+        model: str,
+        k_vals: List[int],
+        configs: List[Tuple[str, Optional[float]]]
+    ) -> Dict[str, Dict[int, List[str]]]:
+        # Caption scores do not depend on alpha; compute them once
+        candidates = prefetched[used_query][:max(1, max(k_vals) * expand)]
+        components = None
+        if model == "clip_rerank" and candidates:
+            components = rerank_components(
+                used_query, candidates, query_embeddings[used_query]
+            )
+
+        return {
+            model_name: run_search(
+                used_query,
+                k_vals,
+                model,
+                alpha=alpha,
+                expand=expand,
+                matches=candidates,
+                components=components
+            )
+            for model_name, alpha in configs
+        }
+
+    # (model, query text, k values) → results, shared across cells
+    results_memo: Dict[Tuple[str, str, Tuple[int, ...]], Future] = {}
+    results_lock = threading.Lock()
+
+    def evaluate_cell(model: str, use_enhancement: bool, difficulty: str) -> List[list]:
+        diff_data = queries_data[difficulty]
+        k_vals = diff_data["k_vals"]
+        rows: List[list] = []
+
+        # Search once per configuration for all k values
+        if model == "clip_rerank":
+            configs = [
+                (f"clip_rerank_a{alpha}", alpha)
+                for _, alpha in model_configs[model]
+            ]
+        else:
+            configs = [(model, None)]
+
+        for query_id, query_text in diff_data["queries"].items():
+            # Get query to use (original or enhanced)
+            if use_enhancement:
+                used_query = get_enhanced_query(query_id, query_text)
+            else:
+                used_query = query_text
+
+            # Enhancement may leave a query unchanged; such texts are searched
+            # once and the results shared by both enhancement settings
+            key = (model, used_query, tuple(k_vals))
+            with results_lock:
+                pending = results_memo.get(key)
+                owner = pending is None
+                if owner:
+                    pending = results_memo[key] = Future()
+
+            if owner:
+                try:
+                    pending.set_result(search_configs(used_query, model, k_vals, configs))
+                except Exception as e:
+                    pending.set_exception(e)
+                    raise
+            config_results = pending.result()
+
+            for k in k_vals:
+                for model_name, _ in configs:
+                    logger.debug("Running: %s, enhancement=%s, %s, %s, k=%d",
+                                 model_name, use_enhancement, difficulty, query_id, k)
+
+                    rows.append([
+                        model_name,
+                        use_enhancement,
+                        difficulty,
+                        query_id,
+                        k,
+                        orjson.dumps(config_results[model_name][k]).decode()  # Store as JSON array
+                    ])
+        return rows
+
+    # Open CSV for writing (large buffer, rows written in chunks)
+    with open(output_file, "w", newline="", encoding="utf-8", buffering=CSV_BUFFER_BYTES) as f:
         writer = csv.writer(f)
         writer.writerow(["model", "enhancement", "difficulty", "query_id", "k", "results"])
 
         total_runs = 0
-        for model in models:
-            for use_enhancement in enhancement_settings:
-                for difficulty in difficulties:
-                    if difficulty not in queries_data:
-                        print(f"Warning: Difficulty '{difficulty}' not found in queries")
-                        continue
-
-                    diff_data = queries_data[difficulty]
-                    k_vals = diff_data["k_vals"]
-                    queries = diff_data["queries"]
-
-                    for query_id, query_text in queries.items():
-                        # Get query to use (original or enhanced)
-                        if use_enhancement:
-                            used_query = get_enhanced_query(query_id, query_text, enhanced_cache)
-                        else:
-                            used_query = query_text
-
-                        for k in k_vals:
-                            # For clip_rerank, try each alpha value
-                            if model == "clip_rerank":
-                                for is_rerank, alpha in model_configs[model]:
-                                    model_name = f"clip_rerank_a{alpha}"
-
-                                    print(f"Running: {model_name}, enhancement={use_enhancement}, "
-                                          f"{difficulty}, {query_id}, k={k}")
-
-                                    results = run_search(
-                                        used_query,
-                                        k,
-                                        "clip_rerank",
-                                        alpha=alpha,
-                                        expand=expand
-                                    )
-
-                                    # Write to CSV
-                                    writer.writerow([
-                                        model_name,
-                                        use_enhancement,
-                                        difficulty,
-                                        query_id,
-                                        k,
-                                        json.dumps(results)  # Store as JSON array
-                                    ])
-                                    total_runs += 1
-
-                            # For clip, just run once
-                            else:
-                                print(f"Running: {model}, enhancement={use_enhancement}, "
-                                      f"{difficulty}, {query_id}, k={k}")
-
-                                results = run_search(
-                                    used_query,
-                                    k,
-                                    model,
-                                    expand=expand
-                                )
-
-                                # Write to CSV
-                                writer.writerow([
-                                    model,
-                                    use_enhancement,
-                                    difficulty,
-                                    query_id,
-                                    k,
-                                    json.dumps(results)  # Store as JSON array
-                                ])
-                                total_runs += 1
+        expected_runs = sum(
+            len(queries_data[difficulty]["queries"])
+            * len(queries_data[difficulty]["k_vals"])
+            * len(model_configs.get(model, [None]))
+            for model, _, difficulty in cells
+        )
+        with ThreadPoolExecutor(max_workers=EVAL_WORKERS) as pool, \
+                tqdm(total=expected_runs, desc="Evaluating", unit="run") as progress:
+            futures = [pool.submit(evaluate_cell, *cell) for cell in cells]
+            for future in futures:
+                rows = future.result()
+                for i in range(0, len(rows), CSV_ROWS_PER_WRITE):
+                    writer.writerows(rows[i:i + CSV_ROWS_PER_WRITE])
+                total_runs += len(rows)
+                progress.update(len(rows))
 
         print(f"\n✓ Evaluation complete!")
         print(f"  Total runs: {total_runs}")
@@ -318,6 +501,9 @@ Examples:
 
   # Evaluate only specific difficulties
   python scripts/evaluate.py --difficulties eq mq
+
+  # Log every configuration instead of only showing a progress bar
+  python scripts/evaluate.py --verbose
         """
     )
 
@@ -348,8 +534,18 @@ Examples:
         help="Query difficulties to evaluate (default: all)"
     )
 
+    parser.add_argument(
+        "-v", "--verbose",
+        action="store_true",
+        help="Log every evaluated configuration"
+    )
+
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
     print("=" * 80)
     print("Image Search Evaluation")
     print("=" * 80)
@@ -0,0 +1,105 @@
+"""Export CLIP to ONNX for the CPU inference backend (CLIP_ONNX_DIR)."""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+
+import torch
+
+
+class _Visual(torch.nn.Module):
+    """Image tower with the projection head (matches sentence-transformers CLIP)."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+class _Textual(torch.nn.Module):
+    """Text tower with the projection head."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+
+def export(model_id: str, out_dir: str, quantize: bool = False) -> None:
+    """
+    Write visual.onnx, textual.onnx, export.json and the preprocessing files
+    to out_dir.
+
+    Args:
+        model_id: Hugging Face CLIP checkpoint the CLIP_MODEL is based on
+        out_dir: Output directory (use as CLIP_ONNX_DIR)
+        quantize: Apply dynamic INT8 weight quantization
+    """
+    from transformers import CLIPModel, CLIPProcessor
+
+    os.makedirs(out_dir, exist_ok=True)
+    model = CLIPModel.from_pretrained(model_id).eval()
+    CLIPProcessor.from_pretrained(model_id).save_pretrained(out_dir)
+
+    visual_path = os.path.join(out_dir, "visual.onnx")
+    textual_path = os.path.join(out_dir, "textual.onnx")
+    size = model.config.vision_config.image_size
+
+    with torch.no_grad():
+        torch.onnx.export(
+            _Visual(model), (torch.zeros(1, 3, size, size),), visual_path,
+            input_names=["pixel_values"], output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=17,
+        )
+        ids = torch.zeros(1, 77, dtype=torch.long)
+        torch.onnx.export(
+            _Textual(model), (ids, torch.ones_like(ids)), textual_path,
+            input_names=["input_ids", "attention_mask"], output_names=["text_embeds"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "seq"},
+                "attention_mask": {0: "batch", 1: "seq"},
+                "text_embeds": {0: "batch"},
+            },
+            opset_version=17,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        for path in (visual_path, textual_path):
+            tmp = path + ".int8"
+            quantize_dynamic(path, tmp, weight_type=QuantType.QInt8)
+            os.replace(tmp, path)
+
+    # Read by OnnxClip so caches don't mix int8 and float32 embeddings
+    with open(os.path.join(out_dir, "export.json"), "w") as f:
+        json.dump({"model": model_id, "precision": "int8" if quantize else "fp32"}, f)
+
+    print(f"Exported {model_id} to {out_dir}")
+    print(f"Set CLIP_ONNX_DIR={out_dir} to use it on CPU")
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Export CLIP to ONNX for CPU inference")
+    parser.add_argument(
+        "--model", default="openai/clip-vit-base-patch32",
+        help="Hugging Face CLIP checkpoint (default: the one behind clip-ViT-B-32)"
+    )
+    parser.add_argument("--out", default="cache/clip_onnx", help="Output directory")
+    parser.add_argument(
+        "--quantize", action="store_true",
+        help="Dynamic INT8 quantization (faster on VNNI CPUs, slightly less accurate)"
+    )
+    args = parser.parse_args()
+    export(args.model, args.out, quantize=args.quantize)
+
+
+if __name__ == "__main__":
+    main()
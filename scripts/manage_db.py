@@ -10,11 +10,12 @@ This script provides utilities to:
 """
 
 import argparse
-import json
 import os
 import sys
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Set
+
+import orjson
 
 # Add src to path
 project_root = Path(__file__).parent.parent
@@ -22,28 +23,99 @@ sys.path.insert(0, str(project_root / "src"))
 
 from imagesearch import index
 from imagesearch.embeddings import file_id, encode_image
-from imagesearch.caption import describe_image, get_cached, put_cached
+from imagesearch.caption import (
+    cached_keys,
+    clear_cache,
+    describe_image,
+    describe_images_batch,
+    get_cached,
+    put_cached,
+)
 from imagesearch.config import DATA_DIR, REDUCE_DIM
+from imagesearch.ratelimit import gemini_limiter
 
 
 # Caption database path
 CAPTIONS_DB_PATH = DATA_DIR / "captions" / "captions.json"
+# Gemini batch jobs still being waited on (lets an interrupted run resume)
+BATCH_STATE_PATH = DATA_DIR / "captions" / "batch_jobs.json"
+
+
+# In-process copy of the caption database and the keys changed since the
+# last write; main() writes them back at the end of each command
+_captions_db: Optional[Dict[str, Dict]] = None
+_captions_db_mtime: Optional[int] = None
+_captions_db_changed: Set[str] = set()
+
+
+def _db_mtime() -> Optional[int]:
+    """Modification time of the caption database file, or None if missing."""
+    try:
+        return os.stat(CAPTIONS_DB_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
 
 
 def load_captions_db() -> Dict[str, Dict]:
-    """Load the captions database from JSON."""
+    """
+    Load the captions database from JSON.
+
+    The parsed database is kept in memory and only re-read when the file
+    changed on disk since it was loaded (unsaved changes always win).
+    """
+    global _captions_db, _captions_db_mtime
+    mtime = _db_mtime()
+    if _captions_db is not None and (_captions_db_changed or mtime == _captions_db_mtime):
+        return _captions_db
+
     CAPTIONS_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    if CAPTIONS_DB_PATH.exists():
-        with open(CAPTIONS_DB_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    if mtime is not None:
+        with open(CAPTIONS_DB_PATH, "rb") as f:
+            _captions_db = orjson.loads(f.read())
+    else:
+        _captions_db = {}
+    _captions_db_mtime = mtime
+    return _captions_db
+
+
+def save_captions_db(db: Dict[str, Dict], keys: Iterable[str]) -> None:
+    """
+    Record changed entries of the captions database.
+
+    Args:
+        db: The loaded database, already updated
+        keys: Vector IDs that were added, replaced or deleted in db
+    """
+    global _captions_db
+    _captions_db = db
+    _captions_db_changed.update(keys)
 
 
-def save_captions_db(db: Dict[str, Dict]) -> None:
-    """Save the captions database to JSON."""
+def flush_captions_db() -> None:
+    """Write the captions database to JSON if it has unsaved changes."""
+    global _captions_db, _captions_db_mtime
+    if not _captions_db_changed:
+        return
+
+    db = _captions_db
+    if _db_mtime() != _captions_db_mtime:
+        # Written by another run since we loaded it: apply our changes on top
+        _captions_db = None
+        changed = {k: db.get(k) for k in _captions_db_changed}
+        db = load_captions_db()
+        for key, entry in changed.items():
+            if entry is None:
+                db.pop(key, None)
+            else:
+                db[key] = entry
+
     CAPTIONS_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(CAPTIONS_DB_PATH, "w", encoding="utf-8") as f:
-        json.dump(db, f, indent=2, ensure_ascii=False)
+    tmp = CAPTIONS_DB_PATH.with_suffix(".json.tmp")
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(db, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, CAPTIONS_DB_PATH)
+    _captions_db_changed.clear()
+    _captions_db_mtime = _db_mtime()
     print(f"Caption database saved to: {CAPTIONS_DB_PATH}")
 
 
@@ -73,7 +145,7 @@ def get_or_generate_caption(image_path: str, use_gemini: bool = True) -> Optiona
     if use_gemini:
         print(f"  Generating caption with Gemini for: {image_path}")
         try:
-            caption, stats = describe_image(image_path)
+            caption, stats = describe_image(image_path, limiter=gemini_limiter)
 
             # Cache the result
             put_cached(vid, caption)
@@ -91,6 +163,119 @@ def get_or_generate_caption(image_path: str, use_gemini: bool = True) -> Optiona
     return None
 
 
+def get_or_generate_captions(
+    image_paths: List[str],
+    caption_db: Optional[Dict[str, Dict]] = None,
+    use_batch: bool = True
+) -> Dict[str, Dict]:
+    """
+    Get captions for many images, generating the missing ones in one Gemini batch job.
+
+    Args:
+        image_paths: Paths to the image files
+        caption_db: Loaded caption database; images already stored there are
+            reused without touching the caption cache
+        use_batch: If False, caption missing images one request at a time
+            instead of waiting on a batch job (which can take hours)
+
+    Returns:
+        Dictionary mapping image path to caption data (same shape as
+        get_or_generate_caption). Images that could not be captioned are left out.
+    """
+    results = {}
+    missing = []
+
+    # Known captions, collected once so unknown images skip cache lookups
+    caption_db = caption_db or {}
+    cached_vids = cached_keys()
+
+    for image_path in image_paths:
+        vid = file_id(image_path)
+        entry = caption_db.get(vid)
+        if entry and entry.get("caption"):
+            results[image_path] = {
+                "caption": entry["caption"],
+                "source": entry.get("source", "cache"),
+                "vector_id": vid
+            }
+            if "stats" in entry:
+                results[image_path]["stats"] = entry["stats"]
+            continue
+
+        cached_caption = get_cached(vid) if vid in cached_vids else None
+        if cached_caption:
+            results[image_path] = {
+                "caption": cached_caption,
+                "source": "cache",
+                "vector_id": vid
+            }
+        else:
+            missing.append((image_path, vid))
+
+    if not missing:
+        return results
+
+    if not use_batch:
+        for image_path, _ in missing:
+            caption_data = get_or_generate_caption(image_path)
+            if caption_data:
+                results[image_path] = caption_data
+        return results
+
+    # Generate all missing captions in a single batch
+    print(f"Generating {len(missing)} captions with Gemini batch mode...")
+    BATCH_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        generated = describe_images_batch(
+            [p for p, _ in missing], state_path=str(BATCH_STATE_PATH)
+        )
+    except Exception as e:
+        print(f"  Error generating captions: {e}")
+        print(f"  Run the command again to resume the jobs in {BATCH_STATE_PATH}")
+        return results
+
+    for image_path, vid in missing:
+        if image_path not in generated:
+            continue
+        caption, stats = generated[image_path]
+
+        # Cache the result
+        put_cached(vid, caption)
+
+        results[image_path] = {
+            "caption": caption,
+            "source": "generated",
+            "vector_id": vid,
+            "stats": stats
+        }
+
+    return results
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def list_image_files(directory: str) -> List[str]:
+    """List the image files in a directory (single pass, any extension case)."""
+    with os.scandir(directory) as it:
+        return sorted(
+            e.path for e in it
+            if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTENSIONS
+        )
+
+
+def caption_entry(image_path: str, caption_data: Dict) -> Dict:
+    """Build the caption database entry for an image."""
+    entry = {
+        "path": image_path,
+        "caption": caption_data["caption"],
+        "source": caption_data["source"]
+    }
+    if "stats" in caption_data:
+        entry["stats"] = caption_data["stats"]
+    return entry
+
+
 def cmd_add(args) -> None:
     """Add images to the database with optional captioning."""
     caption_enabled = args.caption
@@ -113,14 +298,8 @@ def cmd_add(args) -> None:
         # Save caption to database
         if caption_data:
             db = load_captions_db()
-            db[vid] = {
-                "path": args.path,
-                "caption": caption_data["caption"],
-                "source": caption_data["source"]
-            }
-            if "stats" in caption_data:
-                db[vid]["stats"] = caption_data["stats"]
-            save_captions_db(db)
+            db[vid] = caption_entry(args.path, caption_data)
+            save_captions_db(db, [vid])
             print(f"  Caption: {caption_data['caption']}")
 
     elif args.dir:
@@ -130,12 +309,7 @@ def cmd_add(args) -> None:
         print(f"Batch size: {args.batch}\n")
 
         # Get list of image files
-        from glob import glob
-        patterns = ("*.jpg", "*.jpeg", "*.png", "*.JPG", "*.JPEG", "*.PNG")
-        files = sorted({
-            p for pat in patterns
-            for p in glob(os.path.join(args.dir, pat))
-        })
+        files = list_image_files(args.dir)
 
         if not files:
             print(f"No image files found in {args.dir}")
@@ -143,36 +317,36 @@ def cmd_add(args) -> None:
 
         print(f"Found {len(files)} images")
 
-        # Load caption database
+        # Load caption database and caption all uncached images in one batch
         caption_db = load_captions_db() if caption_enabled else None
-
-        # Process in batches
-        for i, file_path in enumerate(files, 1):
-            print(f"\n[{i}/{len(files)}] Processing: {file_path}")
-
-            # Generate/get caption if enabled
-            caption_data = None
-            if caption_enabled:
-                caption_data = get_or_generate_caption(file_path, use_gemini=True)
-
-            # Insert into Pinecone
-            vid = index.upsert_one(file_path)
+        captions = (
+            get_or_generate_captions(files, caption_db, use_batch=not args.no_batch)
+            if caption_enabled else {}
+        )
+
+        # Insert into Pinecone in batches
+        vids = index.upsert_many(
+            files,
+            batch_size=args.batch,
+            ids=[file_id(p) for p in files]
+        )
+
+        stored = []
+        for i, (file_path, vid) in enumerate(zip(files, vids), 1):
+            print(f"\n[{i}/{len(files)}] Processed: {file_path}")
             print(f"  Vector ID: {vid}")
 
+            caption_data = captions.get(file_path)
+
             # Save caption to database
             if caption_data and caption_db is not None:
-                caption_db[vid] = {
-                    "path": file_path,
-                    "caption": caption_data["caption"],
-                    "source": caption_data["source"]
-                }
-                if "stats" in caption_data:
-                    caption_db[vid]["stats"] = caption_data["stats"]
+                caption_db[vid] = caption_entry(file_path, caption_data)
+                stored.append(vid)
                 print(f"  Caption: {caption_data['caption']}")
 
         # Save all captions at once
-        if caption_enabled and caption_db:
-            save_captions_db(caption_db)
+        if stored:
+            save_captions_db(caption_db, stored)
 
         print(f"\nTotal images added: {len(files)}")
     else:
@@ -193,7 +367,7 @@ def cmd_delete(args) -> None:
         db = load_captions_db()
         if vid in db:
             del db[vid]
-            save_captions_db(db)
+            save_captions_db(db, [vid])
             print(f"  Removed from caption database")
 
     elif args.id:
@@ -207,7 +381,7 @@ def cmd_delete(args) -> None:
         db = load_captions_db()
         if args.id in db:
             del db[args.id]
-            save_captions_db(db)
+            save_captions_db(db, [args.id])
             print(f"  Removed from caption database")
     else:
         print("Error: Provide --path or --id")
@@ -321,28 +495,38 @@ def cmd_export_captions(args) -> None:
 
     output_path = args.output or CAPTIONS_DB_PATH
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(db, f, indent=2, ensure_ascii=False)
+    with open(output_path, "wb") as f:
+        f.write(orjson.dumps(db, option=orjson.OPT_INDENT_2))
 
     print(f"Exported {len(db)} captions to: {output_path}")
 
 
 def cmd_generate_captions(args) -> None:
-    """Generate captions for all images in Pinecone that don't have captions yet."""
-    # Get all images from Pinecone
-    stats = index.stats()
-    total = stats.get('total_vector_count', 0)
+    """Generate captions for all images in a directory using Gemini batch mode."""
+    print(f"Generating captions for images in: {args.dir}")
 
-    print(f"Total vectors in Pinecone: {total}")
+    files = list_image_files(args.dir)
+    if not files:
+        print(f"No image files found in {args.dir}")
+        return
+
+    print(f"Found {len(files)} images")
+
+    db = load_captions_db()
+    captions = get_or_generate_captions(files, db, use_batch=not args.no_batch)
+
+    # Store every available caption in the database
+    for file_path, caption_data in captions.items():
+        db[caption_data["vector_id"]] = caption_entry(file_path, caption_data)
+    save_captions_db(db, (c["vector_id"] for c in captions.values()))
 
-    # This is a simplified version - in practice, you'd need to fetch all vectors
-    # from Pinecone which requires pagination through the index
-    print("\nNote: This command generates captions for images specified by path.")
-    print("To generate captions for all indexed images, use the --dir option with 'add' command.")
+    generated = sum(1 for c in captions.values() if c["source"] == "generated")
+    print(f"\nCaptions stored: {len(captions)}/{len(files)} ({generated} newly generated)")
 
 
 def cmd_wipe(args) -> None:
     """Wipe the entire database (Pinecone vectors and/or caption database)."""
+    global _captions_db, _captions_db_mtime
     wipe_pinecone = args.all or args.pinecone
     wipe_captions = args.all or args.captions
 
@@ -381,15 +565,14 @@ def cmd_wipe(args) -> None:
         if CAPTIONS_DB_PATH.exists():
             CAPTIONS_DB_PATH.unlink()
             print(f"  ✓ Deleted {CAPTIONS_DB_PATH}")
+        # Drop pending edits too, so the exit flush can't write them back
+        _captions_db = None
+        _captions_db_mtime = None
+        _captions_db_changed.clear()
 
         # Also clear caption cache
-        from imagesearch.config import CAPTION_CACHE_DIR
-        if CAPTION_CACHE_DIR.exists():
-            import shutil
-            cache_files = list(CAPTION_CACHE_DIR.glob("*.json"))
-            for f in cache_files:
-                f.unlink()
-            print(f"  ✓ Cleared {len(cache_files)} cached captions")
+        cache_count = clear_cache()
+        print(f"  ✓ Cleared {cache_count} cached captions")
 
     print("\n✓ Database wipe completed successfully!")
     print("\nYou can now start fresh by adding new images.")
@@ -429,6 +612,9 @@ Examples:
   # Show database statistics
   python manage_db.py stats
 
+  # Backfill captions for a directory with Gemini batch mode
+  python manage_db.py generate-captions --dir /path/to/images
+
   # Export captions
   python manage_db.py export-captions --output my_captions.json
 
@@ -451,6 +637,10 @@ Examples:
     p_add.add_argument("--dir", help="Path to directory containing images")
     p_add.add_argument("--batch", type=int, default=16, help="Batch size (default: 16)")
     p_add.add_argument("--caption", action="store_true", help="Generate captions using Gemini")
+    p_add.add_argument(
+        "--no-batch", action="store_true",
+        help="Caption images one request at a time instead of a Gemini batch job"
+    )
     p_add.set_defaults(func=cmd_add)
 
     # Delete command
@@ -479,6 +669,18 @@ Examples:
     p_export.add_argument("--output", help="Output JSON file path")
     p_export.set_defaults(func=cmd_export_captions)
 
+    # Generate captions command
+    p_generate = subparsers.add_parser(
+        "generate-captions",
+        help="Generate captions for a directory using Gemini batch mode"
+    )
+    p_generate.add_argument("--dir", required=True, help="Path to directory containing images")
+    p_generate.add_argument(
+        "--no-batch", action="store_true",
+        help="Caption images one request at a time instead of a Gemini batch job"
+    )
+    p_generate.set_defaults(func=cmd_generate_captions)
+
     # Wipe command
     p_wipe = subparsers.add_parser("wipe", help="Wipe database (DESTRUCTIVE)")
     wipe_group = p_wipe.add_mutually_exclusive_group(required=True)
@@ -493,7 +695,10 @@ Examples:
         parser.print_help()
         return
 
-    args.func(args)
+    try:
+        args.func(args)
+    finally:
+        flush_captions_db()
 
 
 if __name__ == "__main__":
@@ -29,9 +29,17 @@ setup(
         "torchvision>=0.15.0",
         "transformers>=4.30.0",
         "google-genai>=0.1.0",
+        "aiolimiter>=1.1.0",
         "tqdm>=4.65.0",
+        "orjson>=3.9.0",
     ],
     extras_require={
+        "sparse": [
+            "scipy>=1.10.0",
+        ],
+        "onnx": [
+            "onnxruntime>=1.16.0",
+        ],
         "dev": [
             "pytest>=7.4.0",
             "black>=23.0.0",
@@ -41,6 +49,8 @@ setup(
     entry_points={
         "console_scripts": [
             "imagesearch=imagesearch.cli:main",
+            "prepare-cache=imagesearch.scripts.prepare_cache:main",
+            "reindex-uploads=imagesearch.scripts.reindex_uploads:main",
         ],
     },
     classifiers=[
@@ -17,13 +17,16 @@ from .config import (
 from .index import (
     upsert_one,
     upsert_dir,
+    upsert_many,
     search,
+    search_many,
     delete_by_path,
     wipe,
     stats,
 )
 from .embeddings import (
     encode_image,
+    encode_image_from_bytes,
     encode_images,
     encode_text_to_index,
     encode_text_clip,
@@ -31,17 +34,21 @@ from .embeddings import (
 )
 from .caption import (
     describe_image,
+    describe_image_async,
+    describe_images_batch,
     load_caption_db,
     offline_caption_getter,
     get_cached as get_cached_caption,
     put_cached as put_cached_caption,
+    clear_cache as clear_caption_cache,
 )
 from .enhance import (
     enhance_query,
+    enhance_query_async,
     load_enhanced_db,
     get_used_query,
 )
-from .rerank import rerank_by_caption
+from .rerank import rerank_by_caption, score_components, blend_scores
 
 __version__ = "1.0.0"
 
@@ -54,26 +61,35 @@ __all__ = [
     # Index operations
     "upsert_one",
     "upsert_dir",
+    "upsert_many",
     "search",
+    "search_many",
     "delete_by_path",
     "wipe",
     "stats",
     # Embeddings
     "encode_image",
+    "encode_image_from_bytes",
     "encode_images",
     "encode_text_to_index",
     "encode_text_clip",
     "file_id",
     # Captions
     "describe_image",
+    "describe_image_async",
+    "describe_images_batch",
     "load_caption_db",
     "offline_caption_getter",
     "get_cached_caption",
     "put_cached_caption",
+    "clear_caption_cache",
     # Query enhancement
     "enhance_query",
+    "enhance_query_async",
     "load_enhanced_db",
     "get_used_query",
     # Reranking
     "rerank_by_caption",
+    "score_components",
+    "blend_scores",
 ]
\ No newline at end of file
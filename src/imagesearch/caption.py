@@ -1,26 +1,39 @@
 """Image captioning using Gemini vision models."""
 
 from __future__ import annotations
-import base64
-import json
+import asyncio
+import os
+import re
+import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
-from typing import Tuple, Dict, Optional
+from typing import Tuple, Dict, List, Optional
 
+import numpy as np
+import orjson
 from PIL import Image
 
-from .config import GEMINI_MODEL, CAPTION_PROMPT, CAPTION_CACHE_DIR
+from .config import (
+    GEMINI_MODEL, CAPTION_PROMPT, CAPTION_CACHE_DB, CAPTION_CACHE_DIR
+)
+from .gemini import http_options
+from .ratelimit import RateLimiter
 
 
 _genai = None
 
+# Image preparation (decode, resize, JPEG encode) runs here so it overlaps
+# with API waits; Pillow releases the GIL for most of this work
+_prep_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="caption-prep")
+
 
 def _get_client():
     """Lazy initialization of Gemini client."""
     global _genai
     if _genai is None:
-        import os
         from google import genai
 
         api_key = os.getenv("GEMINI_API_KEY")
@@ -28,17 +41,23 @@ def _get_client():
             raise RuntimeError(
                 "GEMINI_API_KEY not found. Please set it in your .env file."
             )
-        _genai = genai.Client(api_key=api_key)
+        _genai = genai.Client(api_key=api_key, http_options=http_options())
     return _genai
 
 
+_JPEG_EXTRA_OPTS = (
+    {"optimize": True, "progressive": True}
+    if os.getenv("CAPTION_JPEG_OPTIMIZE") == "1" else {}
+)
+
+
 def _prep_image(
     path: str,
     max_long_edge: int = 256,
     jpeg_quality: int = 50
-) -> Tuple[str, str, Dict]:
+) -> Tuple[str, bytes, Dict]:
     """
-    Prepare image for Gemini API by resizing and converting to base64.
+    Prepare image for Gemini API by resizing and re-encoding as JPEG.
 
     Args:
         path: Path to the image file
@@ -46,30 +65,32 @@ def _prep_image(
         jpeg_quality: JPEG compression quality (1-100)
 
     Returns:
-        Tuple of (mime_type, base64_data, stats)
+        Tuple of (mime_type, jpeg_bytes, stats)
     """
-    img = Image.open(path).convert("RGB")
+    img = Image.open(path)
     w, h = img.size
 
-    # Resize if needed
-    scale = min(1.0, max_long_edge / max(w, h))
-    if scale < 1.0:
-        new_w = max(1, int(w * scale))
-        new_h = max(1, int(h * scale))
-        img = img.resize((new_w, new_h), Image.LANCZOS)
+    # Let libjpeg decode at a reduced scale (no-op for other formats)
+    img.draft("RGB", (max_long_edge, max_long_edge))
+    img = img.convert("RGB")
+
+    # Resize if needed; LANCZOS only pays off for large reductions
+    if max(img.size) > max_long_edge:
+        resample = Image.LANCZOS if max(img.size) >= 2 * max_long_edge else Image.BILINEAR
+        img.thumbnail((max_long_edge, max_long_edge), resample)
 
-    # Convert to JPEG and base64
+    # Convert to JPEG
     buf = BytesIO()
+    # optimize/progressive only shave a few bytes off a thumbnail that is
+    # sent once; they are opt-in (CAPTION_JPEG_OPTIMIZE=1) for debugging size
     img.save(
         buf,
         format="JPEG",
         quality=jpeg_quality,
-        optimize=True,
-        progressive=True,
-        subsampling=2
+        subsampling=2,
+        **_JPEG_EXTRA_OPTS
     )
     data = buf.getvalue()
-    b64_data = base64.b64encode(data).decode("utf-8")
 
     stats = {
         "orig_size": (w, h),
@@ -77,7 +98,7 @@ def _prep_image(
         "jpeg_bytes": len(data)
     }
 
-    return "image/jpeg", b64_data, stats
+    return "image/jpeg", data, stats
 
 
 def _extract_text(resp) -> str:
@@ -104,6 +125,12 @@ def _extract_text(resp) -> str:
     return str(resp)
 
 
+# Verbose lead-ins Gemini sometimes puts before the caption (any case)
+_PREFIX_RE = re.compile(
+    r"^(?:here is|here'?s|certainly|this image|the image shows)[\s,.\-]*", re.I
+)
+
+
 def _clean_caption_text(raw: str) -> str:
     """
     Clean Gemini's caption output to remove verbose prefixes.
@@ -117,33 +144,107 @@ def _clean_caption_text(raw: str) -> str:
     if not raw:
         return ""
 
-    text = raw.strip()
-
-    # Remove content after first colon
-    if ":" in text:
-        text = text.split(":", 1)[1]
+    # Keep only the content after the first colon, if any
+    text = raw.strip().split(":", 1)[-1]
 
     # Remove line breaks and excessive spaces
     text = " ".join(text.split())
 
     # Remove common prefixes
-    prefixes = [
-        "Here is", "Here's", "Certainly", "This image", "The image shows"
-    ]
-    for prefix in prefixes:
-        if text.startswith(prefix):
-            text = text[len(prefix):].lstrip(" ,.-").strip()
-            break
-
-    return text
+    return _PREFIX_RE.sub("", text, count=1).strip()
 
 
 # Cache functions
+_conn: Optional[sqlite3.Connection] = None
+_conn_lock = threading.RLock()
+
+# Every cache row (key → (caption, ts)), bulk-loaded when the database is
+# opened; the whole cache is small (~100 bytes per caption)
+_memory: Dict[str, Tuple[str, float]] = {}
+
+
+def _get_conn() -> sqlite3.Connection:
+    """Open the caption cache database on first use."""
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            CAPTION_CACHE_DB.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(
+                str(CAPTION_CACHE_DB), isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS captions ("
+                "key TEXT PRIMARY KEY, caption TEXT, ts REAL)"
+            )
+            # CLIP text embeddings of captions, filled in lazily by reranking
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS caption_embs ("
+                "key TEXT PRIMARY KEY, caption TEXT, model TEXT, emb BLOB)"
+            )
+            _migrate_json_cache(conn)
+            _memory.update(
+                (key, (caption, ts))
+                for key, caption, ts in conn.execute("SELECT key, caption, ts FROM captions")
+            )
+            _conn = conn
+    return _conn
+
+
 def _cache_path(key: str) -> Path:
-    """Get cache file path for a given key."""
+    """Get the legacy cache file path for a given key (migration only)."""
     return CAPTION_CACHE_DIR / f"{key}.json"
 
 
+def _migrate_json_cache(conn: sqlite3.Connection) -> None:
+    """
+    Import captions from the legacy one-file-per-key cache.
+
+    Imported files are renamed to *.json.migrated rather than deleted, so the
+    captions can still be recovered if the database is lost.
+    """
+    if not CAPTION_CACHE_DIR.is_dir():
+        return
+
+    rows, migrated = [], []
+    with os.scandir(CAPTION_CACHE_DIR) as it:
+        for e in it:
+            if not (e.name.endswith(".json") and e.is_file()):
+                continue
+            key = e.name[:-len(".json")]
+            try:
+                data = orjson.loads(_cache_path(key).read_bytes())
+            except Exception:
+                continue
+            rows.append((key, data.get("caption"), data.get("ts", 0)))
+            migrated.append(e.path)
+
+    if not rows:
+        return
+
+    with conn:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT OR IGNORE INTO captions (key, caption, ts) VALUES (?, ?, ?)", rows
+        )
+    for path in migrated:
+        os.replace(path, path + ".migrated")
+    print(f"[Cache] Migrated {len(rows)} cached captions to {CAPTION_CACHE_DB.name}")
+
+
+def cached_keys() -> set:
+    """
+    List the keys present in the caption cache with a single query.
+
+    Returns:
+        Set of cache keys (typically file hashes)
+    """
+    with _conn_lock:
+        rows = _get_conn().execute("SELECT key FROM captions").fetchall()
+    return {key for (key,) in rows}
+
+
 def get_cached(key: str, ttl_days: int = 365) -> Optional[str]:
     """
     Retrieve cached caption by key.
@@ -155,17 +256,22 @@ def get_cached(key: str, ttl_days: int = 365) -> Optional[str]:
     Returns:
         Cached caption or None if not found/expired
     """
-    p = _cache_path(key)
-    if not p.exists():
-        return None
-
-    try:
-        data = json.loads(p.read_text(encoding="utf-8"))
-        if time.time() - data.get("ts", 0) > ttl_days * 86400:
-            return None
-        return data.get("caption")
-    except Exception:
+    with _conn_lock:
+        conn = _get_conn()
+        row = _memory.get(key)
+        if row is None:
+            # Possibly written by another process since startup
+            row = conn.execute(
+                "SELECT caption, ts FROM captions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            _memory[key] = row
+
+    caption, ts = row
+    if time.time() - (ts or 0) > ttl_days * 86400:
         return None
+    return caption
 
 
 def put_cached(key: str, caption: str):
@@ -176,56 +282,274 @@ def put_cached(key: str, caption: str):
         key: Cache key (typically file hash)
         caption: Caption text to cache
     """
-    p = _cache_path(key)
-    data = {"caption": caption, "ts": time.time()}
-    p.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    row = (caption, time.time())
+    with _conn_lock:
+        _get_conn().execute(
+            "INSERT OR REPLACE INTO captions (key, caption, ts) VALUES (?, ?, ?)",
+            (key, *row)
+        )
+        _memory[key] = row
+
+
+def get_cached_embs(
+    keys: List[str], captions: List[str], model_tag: str
+) -> Dict[str, np.ndarray]:
+    """
+    Look up stored CLIP text embeddings for captions.
+
+    An embedding is only returned if it was computed from the same caption
+    text with the current CLIP model.
+
+    Args:
+        keys: Cache keys (typically file hashes)
+        captions: Caption text each key is expected to have, aligned with keys
+        model_tag: CLIP model and backend the embeddings must come from
+
+    Returns:
+        Mapping of key to its 512-d embedding, for the keys that were found
+    """
+    wanted = {k: c for k, c in zip(keys, captions) if k}
+    if not wanted:
+        return {}
+    marks = ",".join("?" * len(wanted))
+    with _conn_lock:
+        rows = _get_conn().execute(
+            f"SELECT key, caption, model, emb FROM caption_embs WHERE key IN ({marks})",
+            list(wanted)
+        ).fetchall()
+    return {
+        key: np.frombuffer(emb, dtype=np.float32)
+        for key, caption, model, emb in rows
+        if caption == wanted[key] and model == model_tag
+    }
+
+
+def put_cached_embs(
+    keys: List[str], captions: List[str], embs: np.ndarray, model_tag: str
+) -> None:
+    """
+    Store CLIP text embeddings of captions.
+
+    Args:
+        keys: Cache keys (typically file hashes)
+        captions: Caption text each embedding was computed from
+        embs: Embeddings of shape (N, 512), aligned with keys
+        model_tag: CLIP model and backend that produced the embeddings
+    """
+    embs = np.asarray(embs, dtype=np.float32)
+    rows = [
+        (key, caption, model_tag, emb.tobytes())
+        for key, caption, emb in zip(keys, captions, embs) if key
+    ]
+    with _conn_lock:
+        _get_conn().executemany(
+            "INSERT OR REPLACE INTO caption_embs (key, caption, model, emb) VALUES (?, ?, ?, ?)",
+            rows
+        )
+
+
+def clear_cache() -> int:
+    """
+    Delete every cached caption and caption embedding.
+
+    Also removes the *.json.migrated backups of the legacy cache.
+
+    Returns:
+        Number of captions removed
+    """
+    with _conn_lock:
+        # Opening the connection loads all rows into _memory, so clear after
+        conn = _get_conn()
+        conn.execute("DELETE FROM caption_embs")
+        removed = conn.execute("DELETE FROM captions").rowcount
+        _memory.clear()
+
+    if CAPTION_CACHE_DIR.is_dir():
+        for path in CAPTION_CACHE_DIR.glob("*.json.migrated"):
+            path.unlink(missing_ok=True)
+    return removed
 
 
 # Main caption function
-def describe_image(path: str) -> Tuple[str, Dict]:
+def _build_caption_contents(mime: str, data: bytes) -> list:
+    """Build the Gemini request contents for captioning one image."""
+    from google.genai import types
+
+    # Raw bytes go straight to the SDK; no base64 copy of the payload
+    return [types.Content(role="user", parts=[
+        types.Part.from_bytes(data=data, mime_type=mime),
+        types.Part(text=CAPTION_PROMPT),
+    ])]
+
+
+def describe_image(path: str, limiter: Optional[RateLimiter] = None) -> Tuple[str, Dict]:
     """
     Generate a caption for an image using Gemini.
 
     Args:
         path: Path to the image file
+        limiter: Rate limiter to wait on before the request (bulk callers
+            pass ratelimit.gemini_limiter; interactive calls are not paced)
 
     Returns:
         Tuple of (caption, stats) where stats includes token counts
     """
     client = _get_client()
-    mime, b64, stats = _prep_image(path)
+    mime, data, stats = _prep_image(path)
+    contents = _build_caption_contents(mime, data)
 
-    contents = [{
-        "role": "user",
-        "parts": [
-            {"inline_data": {"mime_type": mime, "data": b64}},
-            {"text": CAPTION_PROMPT}
-        ]
-    }]
+    # Generate caption (token counts come back in the response metadata)
+    if limiter is not None:
+        limiter.acquire()
+    resp = client.models.generate_content(model=GEMINI_MODEL, contents=contents)
+    return _caption_result(resp, stats)
 
-    # Count input tokens
-    try:
-        ct = client.models.count_tokens(model=GEMINI_MODEL, contents=contents)
-        input_tokens = getattr(ct, "total_tokens", None)
-    except Exception:
-        input_tokens = None
 
-    # Generate caption
-    resp = client.models.generate_content(model=GEMINI_MODEL, contents=contents)
+async def describe_image_async(path: str) -> Tuple[str, Dict]:
+    """
+    Async version of describe_image using the Gemini asyncio client.
+
+    Image preparation runs on a shared thread pool, so encoding the next
+    image overlaps the network wait for the previous ones.
+
+    Args:
+        path: Path to the image file
+
+    Returns:
+        Tuple of (caption, stats) where stats includes token counts
+    """
+    client = _get_client()
+    loop = asyncio.get_running_loop()
+    mime, data, stats = await loop.run_in_executor(_prep_pool, _prep_image, path)
+    contents = _build_caption_contents(mime, data)
+
+    # Generate caption (token counts come back in the response metadata)
+    resp = await client.aio.models.generate_content(model=GEMINI_MODEL, contents=contents)
+    return _caption_result(resp, stats)
+
+
+def _caption_result(resp, stats: Dict) -> Tuple[str, Dict]:
+    """Clean the caption of a Gemini response and attach token counts."""
     raw_caption = _extract_text(resp)
     caption = _clean_caption_text(raw_caption)
 
-    # Get output tokens
+    # Token counts from the response's usage metadata
     um = getattr(resp, "usage_metadata", None)
-    output_tokens = getattr(um, "output_tokens", None) if um else None
-
     return caption, {
-        "input_tokens": input_tokens,
-        "output_tokens": output_tokens,
+        "input_tokens": getattr(um, "prompt_token_count", None) if um else None,
+        "output_tokens": getattr(um, "candidates_token_count", None) if um else None,
         **stats
     }
 
 
+_BATCH_DONE_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
+
+def _save_batch_state(state_path: str, jobs: list) -> None:
+    """Record submitted batch jobs so an interrupted run can resume them."""
+    tmp = state_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps({"jobs": [
+            {"name": job.name, "paths": chunk, "stats": chunk_stats}
+            for job, chunk, chunk_stats in jobs
+        ]}, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, state_path)
+
+
+def describe_images_batch(
+    paths: List[str],
+    chunk_size: int = 1000,
+    poll_interval: float = 30.0,
+    state_path: Optional[str] = None
+) -> Dict[str, Tuple[str, Dict]]:
+    """
+    Generate captions for many images with a Gemini batch job.
+
+    Batch mode is asynchronous and cheaper than one request per image, so it
+    is meant for bulk backfills. Images are split into jobs of chunk_size
+    inline requests, all jobs are submitted, then polled until finished.
+
+    With state_path, submitted jobs are recorded there as they are created.
+    A later call with the same state_path polls the recorded jobs instead
+    of resubmitting their images; the file is removed once all jobs finish.
+
+    Args:
+        paths: Paths to the image files
+        chunk_size: Maximum number of images per batch job
+        poll_interval: Seconds to wait between job status checks
+        state_path: JSON file tracking submitted jobs (optional)
+
+    Returns:
+        Dictionary mapping each successfully captioned path to (caption, stats).
+        Images whose request failed are left out.
+    """
+    client = _get_client()
+
+    # Resume jobs submitted by an earlier, interrupted call
+    jobs = []
+    if state_path and os.path.exists(state_path):
+        with open(state_path, "rb") as f:
+            for rec in orjson.loads(f.read())["jobs"]:
+                job = client.batches.get(name=rec["name"])
+                print(f"[Batch] Resuming {job.name} with {len(rec['paths'])} images")
+                jobs.append((job, rec["paths"], rec["stats"]))
+        submitted = {p for _, chunk, _ in jobs for p in chunk}
+        paths = [p for p in paths if p not in submitted]
+
+    # Submit one job per chunk
+    for start in range(0, len(paths), chunk_size):
+        chunk = paths[start:start + chunk_size]
+        requests, chunk_stats = [], []
+        for mime, data, stats in _prep_pool.map(_prep_image, chunk):
+            requests.append({"contents": _build_caption_contents(mime, data)})
+            chunk_stats.append(stats)
+
+        job = client.batches.create(
+            model=GEMINI_MODEL,
+            src=requests,
+            config={"display_name": f"captions-{int(time.time())}-{start}"},
+        )
+        print(f"[Batch] Submitted {job.name} with {len(chunk)} images")
+        jobs.append((job, chunk, chunk_stats))
+        if state_path:
+            _save_batch_state(state_path, jobs)
+
+    # Wait for the jobs and collect their responses
+    results: Dict[str, Tuple[str, Dict]] = {}
+    for job, chunk, chunk_stats in jobs:
+        try:
+            while job.state.name not in _BATCH_DONE_STATES:
+                time.sleep(poll_interval)
+                job = client.batches.get(name=job.name)
+        except BaseException:
+            where = f"recorded in {state_path}" if state_path else "still running"
+            print(f"[Batch] Stopped waiting; jobs are {where}: "
+                  + ", ".join(j.name for j, _, _ in jobs))
+            raise
+
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            print(f"[Batch] Job {job.name} finished with state {job.state.name}")
+            continue
+
+        responses = job.dest.inlined_responses or []
+        for path, stats, item in zip(chunk, chunk_stats, responses):
+            resp = getattr(item, "response", None)
+            if resp is None:
+                print(f"[Batch] No caption for {path}: {getattr(item, 'error', None)}")
+                continue
+
+            results[path] = _caption_result(resp, stats)
+
+    if state_path and os.path.exists(state_path):
+        os.remove(state_path)
+    return results
+
+
 # Utility functions for working with caption databases
 def _strip_path(path: str) -> str:
     """
@@ -233,7 +557,6 @@ def _strip_path(path: str) -> str:
 
     Example: "example_images/ed1_1.jpg" -> "ed1_1"
     """
-    import os
     base = os.path.basename(path)
     stem, _ = os.path.splitext(base)
     return stem
@@ -243,20 +566,30 @@ def load_caption_db(path: str = "data/captions/captions.json") -> Dict[str, str]
     """
     Load pre-generated captions from JSON file.
 
+    The parsed dictionary is memoized and shared between calls until the
+    file changes, so callers must not modify it.
+
     Args:
         path: Path to captions JSON file
 
     Returns:
         Dictionary mapping filename stems to captions
     """
-    import os
     if not os.path.exists(path):
         raise RuntimeError(
-            f"{path} not found. Run scripts/prepare_cache.py first "
+            f"{path} not found. Run prepare-cache first "
             "to generate captions."
         )
-    with open(path, "r") as f:
-        return json.load(f)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _DB_CACHE.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as f:
+            cached = _DB_CACHE[path] = (mtime, orjson.loads(f.read()))
+    return cached[1]
+
+
+# Parsed caption databases: path → (mtime_ns, captions)
+_DB_CACHE: Dict[str, Tuple[int, Dict[str, str]]] = {}
 
 
 def offline_caption_getter(caption_db: Dict[str, str]):
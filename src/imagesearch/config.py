@@ -10,27 +10,47 @@ load_dotenv()
 
 # Directory paths
 PROJECT_ROOT = Path(__file__).parent.parent.parent
-CACHE_DIR = PROJECT_ROOT / "cache"
-DATA_DIR = PROJECT_ROOT / "data"
+# Overridable so an installed (non-editable) package does not write into site-packages
+CACHE_DIR = Path(os.getenv("CACHE_DIR", str(PROJECT_ROOT / "cache")))
+DATA_DIR = Path(os.getenv("DATA_DIR", str(PROJECT_ROOT / "data")))
 
-# Cache directories
-CAPTION_CACHE_DIR = CACHE_DIR / "caption_cache"
+# Cache locations
+CAPTION_CACHE_DB = CACHE_DIR / "captions.sqlite"
+CAPTION_CACHE_DIR = CACHE_DIR / "caption_cache"  # legacy one-JSON-per-key cache
 QUERY_CACHE_DIR = CACHE_DIR / "query_cache"
-CAPTION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 QUERY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
 # Random Projection settings
 REDUCE_DIM = int(os.getenv("REDUCE_DIM", "384"))
-RP_MATRIX_PATH = str(CACHE_DIR / f"rp_512_to_{REDUCE_DIM}.npy")
+# "dense" (Gaussian) or "sparse" (one ±1 per 16 input rows, needs scipy).
+# The two produce different vectors, so each gets its own matrix and index.
+RP_KIND = os.getenv("RP_KIND", "dense")
+if RP_KIND not in ("dense", "sparse"):
+    raise ValueError(f"RP_KIND must be 'dense' or 'sparse', got {RP_KIND!r}")
+_RP_SUFFIX = "" if RP_KIND == "dense" else f"-{RP_KIND}"
+if RP_KIND == "sparse":
+    RP_MATRIX_PATH = str(CACHE_DIR / f"rp_512_to_{REDUCE_DIM}_sparse.npz")
+else:
+    RP_MATRIX_PATH = str(CACHE_DIR / f"rp_512_to_{REDUCE_DIM}.npy")
 
 # Pinecone index settings
-INDEX_NAME = os.getenv("INDEX_NAME", f"img-search-clip-rp-{REDUCE_DIM}")
+INDEX_NAME = os.getenv("INDEX_NAME", f"img-search-clip-rp-{REDUCE_DIM}{_RP_SUFFIX}")
 PINECONE_CLOUD = os.getenv("PINECONE_CLOUD", "aws")
 PINECONE_REGION = os.getenv("PINECONE_REGION", "us-east-1")
+PINECONE_POOL_THREADS = int(os.getenv("PINECONE_POOL_THREADS", "30"))
 
 # Model configurations
 CLIP_MODEL = os.getenv("CLIP_MODEL", "sentence-transformers/clip-ViT-B-32")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# Run CLIP in half precision on CUDA/MPS. Off by default: fp16 vectors
+# differ slightly from the float32 ones already in the index.
+CLIP_FP16 = os.getenv("CLIP_FP16", "0") == "1"
+# Directory with an ONNX export of CLIP_MODEL, used on CPU-only machines
+# (see scripts/export_clip_onnx.py); empty = sentence-transformers
+CLIP_ONNX_DIR = os.getenv("CLIP_ONNX_DIR", "")
+
+# Gemini request budget (calls per minute; free tier default)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
 
 # Caption generation prompt
 CAPTION_PROMPT = (
@@ -84,4 +104,14 @@ ENHANCE_FEW_SHOTS = [
         "feeling lonely",
         "feeling lonely, the image might include a single person sitting alone on a bench in an open space"
     ),
-]
\ No newline at end of file
+]
+
+# Few-shot examples as prebuilt conversation turns, formatted once at import
+ENHANCE_FEW_SHOT_TURNS = [
+    turn
+    for q, a in ENHANCE_FEW_SHOTS
+    for turn in (
+        {"role": "user", "parts": [{"text": q}]},
+        {"role": "model", "parts": [{"text": a}]},
+    )
+]
@@ -1,16 +1,34 @@
 """CLIP embeddings with random projection for dimensionality reduction."""
 
 from __future__ import annotations
+import atexit
+import functools
 import hashlib
+import math
+import mmap
 import os
-from typing import Iterable
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Iterable, List, Optional, Union
 
 import numpy as np
 import torch
 from PIL import Image
 from sentence_transformers import SentenceTransformer
 
-from .config import CLIP_MODEL, REDUCE_DIM, RP_MATRIX_PATH
+from .config import (
+    CLIP_FP16,
+    CLIP_MODEL,
+    CLIP_ONNX_DIR,
+    QUERY_CACHE_DIR,
+    REDUCE_DIM,
+    RP_KIND,
+    RP_MATRIX_PATH,
+)
 
 
 # Device selection
@@ -24,25 +42,99 @@ def _get_device() -> str:
 
 
 DEVICE = _get_device()
-_model = SentenceTransformer(CLIP_MODEL, device=DEVICE)
+if CLIP_ONNX_DIR and DEVICE == "cpu":
+    # Optional ONNX Runtime export of the same model (faster on CPU)
+    from .onnx_clip import OnnxClip
+
+    _model = OnnxClip(CLIP_ONNX_DIR)
+    _backend = f"onnx-{_model.precision}"
+else:
+    _model = SentenceTransformer(CLIP_MODEL, device=DEVICE)
+    if CLIP_FP16 and DEVICE in ("cuda", "mps"):
+        _model.half()
+        _backend = "torch-fp16"
+    else:
+        _backend = "torch-fp32"
+
+# Identifies the vectors this process produces; cached embeddings from a
+# different model, backend or precision are not reused
+CLIP_CACHE_TAG = f"{CLIP_MODEL}|{_backend}"
+
+
+def _clip_encode(inputs, normalize: bool = True, **kwargs) -> np.ndarray:
+    """
+    Run the CLIP model and return float32 embeddings.
+
+    Paths that go straight into rp_project_and_norm pass normalize=False:
+    the projection is linear and renormalizes, so a prior L2 pass is wasted.
+    """
+    embs = _model.encode(
+        inputs, convert_to_numpy=True, normalize_embeddings=normalize, **kwargs
+    )
+    return embs.astype(np.float32, copy=False)
 
 
 # Random Projection utilities
+_RP_MATRIX: Optional[np.ndarray] = None
+
+# The classic 1/sqrt(D) RP scale cancels under L2 normalization; it only
+# survives in the epsilon, which matches normalizing the scaled vectors
+_RP_NORM_EPS = 1e-12 * math.sqrt(REDUCE_DIM)
+
+# Sparse RP: one ±1 entry per block of this many input rows in each column
+SPARSE_RP_BLOCK = 16
+
+
+def _sparse_rp_matrix():
+    """Load or create the sparse signed projection matrix (RP_KIND=sparse)."""
+    import scipy.sparse as sp
+
+    if os.path.exists(RP_MATRIX_PATH):
+        return sp.load_npz(RP_MATRIX_PATH).tocsr().astype(np.float32)
+
+    rng = np.random.default_rng(42)
+    n_blocks = 512 // SPARSE_RP_BLOCK
+    rows = (np.arange(n_blocks)[:, None] * SPARSE_RP_BLOCK
+            + rng.integers(0, SPARSE_RP_BLOCK, size=(n_blocks, REDUCE_DIM)))
+    cols = np.broadcast_to(np.arange(REDUCE_DIM), rows.shape)
+    signs = rng.choice(np.array([-1.0, 1.0], dtype=np.float32), size=rows.shape)
+    R = sp.csr_matrix(
+        (signs.ravel(), (rows.ravel(), cols.ravel())),
+        shape=(512, REDUCE_DIM), dtype=np.float32
+    )
+    sp.save_npz(RP_MATRIX_PATH, R)
+    print(f"[RP] Created sparse matrix {R.shape} ({R.nnz} nonzeros), saved to {RP_MATRIX_PATH}")
+    return R
+
+
 def ensure_rp_matrix() -> np.ndarray:
     """
     Load or create a Random Projection matrix for dimensionality reduction.
 
+    The matrix is read from disk once per process and kept in memory as a
+    C-contiguous float32 array (a scipy CSR matrix when RP_KIND=sparse).
+
     Returns:
         Random projection matrix of shape (512, REDUCE_DIM)
     """
+    global _RP_MATRIX
+    if _RP_MATRIX is not None:
+        return _RP_MATRIX
+
+    if RP_KIND == "sparse":
+        _RP_MATRIX = _sparse_rp_matrix()
+        return _RP_MATRIX
+
     if os.path.exists(RP_MATRIX_PATH):
-        return np.load(RP_MATRIX_PATH)
+        R = np.load(RP_MATRIX_PATH)
+    else:
+        rng = np.random.default_rng(42)
+        R = rng.normal(0.0, 1.0, size=(512, REDUCE_DIM)).astype(np.float32)
+        np.save(RP_MATRIX_PATH, R)
+        print(f"[RP] Created matrix {R.shape}, saved to {RP_MATRIX_PATH}")
 
-    rng = np.random.default_rng(42)
-    R = rng.normal(0.0, 1.0, size=(512, REDUCE_DIM)).astype(np.float32)
-    np.save(RP_MATRIX_PATH, R)
-    print(f"[RP] Created matrix {R.shape}, saved to {RP_MATRIX_PATH}")
-    return R
+    _RP_MATRIX = np.ascontiguousarray(R, dtype=np.float32)
+    return _RP_MATRIX
 
 
 def rp_project_and_norm(vecs: np.ndarray, R: np.ndarray) -> np.ndarray:
@@ -58,68 +150,126 @@ def rp_project_and_norm(vecs: np.ndarray, R: np.ndarray) -> np.ndarray:
     """
     if vecs.ndim == 1:
         vecs = vecs.reshape(1, -1)
+    # float32 C-contiguous input keeps the product a single SGEMM/SGEMV call;
+    # a float64 input would otherwise upcast all of R on every call
+    vecs = np.ascontiguousarray(vecs, dtype=np.float32)
 
-    # Project to lower dimension
-    X = vecs @ R
-    X = X / np.sqrt(REDUCE_DIM, dtype=np.float32)
+    # Project to lower dimension (sparse R: sparse-dense product)
+    if isinstance(R, np.ndarray):
+        X = vecs @ R
+    else:
+        X = np.asarray((R.T @ vecs.T).T, dtype=np.float32)
 
-    # Normalize
-    norms = np.linalg.norm(X, axis=1, keepdims=True) + 1e-12
-    return X / norms
+    # L2-normalize in one in-place pass over X: one reciprocal per row, then
+    # a multiply per element
+    norms = np.sqrt(np.einsum("ij,ij->i", X, X))
+    norms += _RP_NORM_EPS
+    X *= np.reciprocal(norms)[:, None]
+    return X
 
 
 # File utilities
+# Files at least this large are hashed through mmap
+MMAP_HASH_MIN_BYTES = 8 * 1024 * 1024
+
+
 def file_id(path: str) -> str:
     """
     Generate a unique hash ID for a file based on its content.
 
+    The hash is memoized per (path, mtime, size), so files that have not
+    changed are only read once per process.
+
     Args:
         path: Path to the file
 
     Returns:
         SHA-1 hexdigest of the file content
     """
-    h = hashlib.sha1()
-    with open(path, "rb") as f:
+    st = os.stat(path)
+    return _hash_file(path, st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=65536)
+def _hash_file(path: str, mtime_ns: int, size: int) -> str:
+    """SHA-1 of a file's content; mtime_ns and size only key the memo."""
+    with open(path, "rb", buffering=0) as f:
+        # Large files: hash the mapped pages in one update, with no read copies
+        if size >= MMAP_HASH_MIN_BYTES:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return hashlib.sha1(mm).hexdigest()
+        # Python 3.11+: reads straight into OpenSSL without a Python-level loop
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha1").hexdigest()
+        h = hashlib.sha1()
         for chunk in iter(lambda: f.read(1024 * 1024), b""):
             h.update(chunk)
-    return h.hexdigest()
+        return h.hexdigest()
 
 
-def load_image(path: str) -> Image.Image:
+def load_image(path: Union[str, bytes]) -> Image.Image:
     """
     Load an image from disk and convert to RGB.
 
     Args:
-        path: Path to the image file
+        path: Path to the image file, or the file's contents already in memory
 
     Returns:
         PIL Image in RGB format
     """
+    if isinstance(path, bytes):
+        return Image.open(BytesIO(path)).convert("RGB")
     return Image.open(path).convert("RGB")
 
 
+def _decode_batches(paths: List[Union[str, bytes]], batch_size: int, num_workers: int):
+    """
+    Yield decoded images batch_size at a time, decoding one batch ahead.
+
+    The next batch is submitted to the thread pool before the current one is
+    yielded, so JPEG decoding runs while the model encodes the current batch.
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as ex:
+        chunks = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+        ahead = [ex.submit(load_image, p) for p in chunks[0]] if chunks else []
+        for k in range(len(chunks)):
+            imgs = [f.result() for f in ahead]
+            if k + 1 < len(chunks):
+                ahead = [ex.submit(load_image, p) for p in chunks[k + 1]]
+            yield imgs
+
+
 # Encoding functions
-def encode_images(paths: Iterable[str], batch_size: int = 16) -> np.ndarray:
+def encode_images(
+    paths: Iterable[Union[str, bytes]],
+    batch_size: int = 16,
+    num_workers: int = 1
+) -> np.ndarray:
     """
     Encode multiple images to reduced-dimension embeddings.
 
     Args:
-        paths: Iterable of image file paths
+        paths: Iterable of image file paths (or in-memory file contents)
         batch_size: Batch size for encoding
+        num_workers: Threads used to decode images (Pillow releases the GIL).
+            With more than one, decoding of the next batch overlaps encoding.
 
     Returns:
         Array of embeddings with shape (N, REDUCE_DIM)
     """
     R = ensure_rp_matrix()
-    imgs = [load_image(p) for p in paths]
-    embs512 = _model.encode(
-        imgs,
-        batch_size=batch_size,
-        convert_to_numpy=True,
-        normalize_embeddings=True
-    )
-    return rp_project_and_norm(embs512, R)
+    if num_workers <= 1:
+        imgs = [load_image(p) for p in paths]
+        embs512 = _clip_encode(imgs, normalize=False, batch_size=batch_size)
+        return rp_project_and_norm(embs512, R)
+
+    parts = [
+        _clip_encode(imgs, normalize=False, batch_size=batch_size)
+        for imgs in _decode_batches(list(paths), batch_size, num_workers)
+    ]
+    if not parts:
+        return np.empty((0, REDUCE_DIM), dtype=np.float32)
+    return rp_project_and_norm(np.concatenate(parts), R)
 
 
 def encode_image(path: str) -> np.ndarray:
@@ -134,10 +284,170 @@ def encode_image(path: str) -> np.ndarray:
     """
     R = ensure_rp_matrix()
     img = load_image(path)
-    emb512 = _model.encode(img, convert_to_numpy=True, normalize_embeddings=True)
+    emb512 = _clip_encode(img, normalize=False)
     return rp_project_and_norm(emb512, R)[0]
 
 
+def encode_image_from_bytes(data: bytes) -> np.ndarray:
+    """
+    Encode an image that is already in memory (e.g. an upload).
+
+    Args:
+        data: Encoded image file contents
+
+    Returns:
+        Embedding vector of shape (REDUCE_DIM,)
+    """
+    R = ensure_rp_matrix()
+    img = load_image(data)
+    emb512 = _clip_encode(img, normalize=False)
+    return rp_project_and_norm(emb512, R)[0]
+
+
+# Text embedding cache: text → 512-d CLIP embedding, kept in an LRU and
+# persisted across restarts (repeated queries skip the CLIP forward pass)
+TEXT_EMB_CACHE_PATH = QUERY_CACHE_DIR / "text_embs.npz"
+TEXT_EMB_CACHE_SIZE = 4096
+
+_text_embs: Optional[OrderedDict[str, np.ndarray]] = None
+_text_embs_dirty = False
+_text_embs_lock = threading.Lock()
+
+
+def _text_emb_cache() -> OrderedDict[str, np.ndarray]:
+    """Return the text embedding LRU, loading it from disk on first use."""
+    global _text_embs
+    if _text_embs is None:
+        _text_embs = OrderedDict()
+        if TEXT_EMB_CACHE_PATH.exists():
+            try:
+                with np.load(TEXT_EMB_CACHE_PATH) as z:
+                    # Embeddings from a different CLIP model or backend are discarded
+                    if str(z["model"]) == CLIP_CACHE_TAG:
+                        for text, emb in zip(z["texts"].tolist(), z["embs"]):
+                            emb.setflags(write=False)
+                            _text_embs[text] = emb
+            except Exception as e:
+                print(f"[Embeddings] Ignoring unreadable {TEXT_EMB_CACHE_PATH}: {e}")
+    return _text_embs
+
+
+def save_text_emb_cache() -> None:
+    """Persist the text embedding cache if it gained entries (runs at exit)."""
+    global _text_embs_dirty
+    with _text_embs_lock:
+        if not _text_embs_dirty or not _text_embs:
+            return
+        tmp = TEXT_EMB_CACHE_PATH.with_name(TEXT_EMB_CACHE_PATH.stem + ".tmp.npz")
+        np.savez(
+            tmp,
+            model=np.array(CLIP_CACHE_TAG),
+            texts=np.array(list(_text_embs.keys())),
+            embs=np.stack(list(_text_embs.values())),
+        )
+        os.replace(tmp, TEXT_EMB_CACHE_PATH)
+        _text_embs_dirty = False
+
+
+atexit.register(save_text_emb_cache)
+
+
+class TextEncodeBatcher:
+    """
+    Coalesce concurrent single-text encodes into one CLIP forward pass.
+
+    Callers block in encode() while a background thread encodes everything
+    queued (up to max_batch texts) as one batch and hands each caller its
+    row. Requests that arrive while a batch is running are picked up together
+    by the next one. A lone request is encoded immediately; the worker only
+    waits (up to max_wait seconds) for callers that have registered but not
+    yet queued their text.
+    """
+
+    def __init__(self, max_batch: int = 32, max_wait: float = 0.005):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._pending = 0  # callers waiting for a result
+        self._pending_lock = threading.Lock()
+
+    def encode(self, text: str) -> np.ndarray:
+        """Return the 512-d normalized CLIP embedding of text."""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="text-encode-batcher", daemon=True
+                    )
+                    self._thread.start()
+        done = threading.Event()
+        slot: list = [None, None]  # [embedding, exception]
+        with self._pending_lock:
+            self._pending += 1
+        self._queue.put((text, done, slot))
+        done.wait()
+        if slot[1] is not None:
+            raise slot[1]
+        return slot[0]
+
+    def _run(self) -> None:
+        while True:
+            items = [self._queue.get()]
+            # Take whatever is already queued without waiting
+            while len(items) < self.max_batch:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Briefly wait only for other callers already in encode()
+            deadline = time.monotonic() + self.max_wait
+            while len(items) < self.max_batch and self._pending > len(items):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                embs = _clip_encode([t for t, _, _ in items], batch_size=len(items))
+                results = [(emb, None) for emb in embs]
+            except Exception as e:
+                results = [(None, e)] * len(items)
+            with self._pending_lock:
+                self._pending -= len(items)
+            for (_, done, slot), (emb, err) in zip(items, results):
+                slot[0], slot[1] = emb, err
+                done.set()
+
+
+_text_batcher = TextEncodeBatcher()
+
+
+def _encode_text_cached(text: str) -> np.ndarray:
+    """512-d normalized CLIP embedding of text, served from the cache when possible."""
+    global _text_embs_dirty
+    with _text_embs_lock:
+        cache = _text_emb_cache()
+        emb = cache.get(text)
+        if emb is not None:
+            cache.move_to_end(text)
+            return emb
+
+    emb = _text_batcher.encode(text)
+    emb.setflags(write=False)  # shared between callers
+
+    with _text_embs_lock:
+        cache[text] = emb
+        if len(cache) > TEXT_EMB_CACHE_SIZE:
+            cache.popitem(last=False)
+        _text_embs_dirty = True
+    return emb
+
+
 def encode_text_to_index(text: str) -> np.ndarray:
     """
     Encode text to reduced-dimension embedding for indexing/search.
@@ -149,10 +459,26 @@ def encode_text_to_index(text: str) -> np.ndarray:
         Embedding vector of shape (REDUCE_DIM,)
     """
     R = ensure_rp_matrix()
-    q512 = _model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+    q512 = _encode_text_cached(text)
     return rp_project_and_norm(q512, R)[0]
 
 
+def encode_texts_to_index(texts: list[str], batch_size: int = 32) -> np.ndarray:
+    """
+    Encode multiple texts to reduced-dimension embeddings for search.
+
+    Args:
+        texts: List of query texts
+        batch_size: Batch size for encoding
+
+    Returns:
+        Array of embeddings with shape (N, REDUCE_DIM)
+    """
+    R = ensure_rp_matrix()
+    q512 = _clip_encode(texts, normalize=False, batch_size=batch_size)
+    return rp_project_and_norm(q512, R)
+
+
 def encode_text_clip(text: str) -> np.ndarray:
     """
     Encode text to full 512-d CLIP embedding (no random projection).
@@ -162,9 +488,9 @@ def encode_text_clip(text: str) -> np.ndarray:
         text: Text to encode
 
     Returns:
-        Embedding vector of shape (512,)
+        Embedding vector of shape (512,); shared, do not modify in place
     """
-    return _model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+    return _encode_text_cached(text)
 
 
 def encode_texts_clip(texts: list[str]) -> np.ndarray:
@@ -177,4 +503,4 @@ def encode_texts_clip(texts: list[str]) -> np.ndarray:
     Returns:
         Array of embeddings with shape (N, 512)
     """
-    return _model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
\ No newline at end of file
+    return _clip_encode(texts)
\ No newline at end of file
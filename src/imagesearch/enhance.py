@@ -1,26 +1,131 @@
 """Query enhancement using Gemini for improved search results."""
 
 from __future__ import annotations
+import atexit
+import functools
 import os
-from typing import Dict
+import threading
+from typing import Dict, Optional
+
+import orjson
 
 from .config import (
     GEMINI_MODEL,
     ENHANCE_SYSTEM_PROMPT,
-    ENHANCE_FEW_SHOTS,
+    ENHANCE_FEW_SHOT_TURNS,
+    QUERY_CACHE_DIR,
 )
+from .gemini import http_options
+from .ratelimit import RateLimiter
 
 
-def _get_genai_client():
-    """Initialize and return Gemini client."""
-    from google import genai
+# Enhanced queries persisted across restarts: query text → enhanced text
+ENHANCED_CACHE_PATH = QUERY_CACHE_DIR / "enhanced.json"
+
+_disk_cache: Optional[Dict[str, str]] = None
+_disk_cache_dirty = False
+_disk_cache_lock = threading.Lock()
+
+
+def _load_disk_cache() -> Dict[str, str]:
+    """Return the persisted enhancement cache, loading it on first use."""
+    global _disk_cache
+    if _disk_cache is None:
+        _disk_cache = {}
+        if ENHANCED_CACHE_PATH.exists():
+            try:
+                data = orjson.loads(ENHANCED_CACHE_PATH.read_bytes())
+                # Enhancements from a different Gemini model are discarded
+                if data.get("model") == GEMINI_MODEL:
+                    _disk_cache = data.get("queries", {})
+            except (OSError, ValueError) as e:
+                print(f"[Enhance] Ignoring unreadable {ENHANCED_CACHE_PATH}: {e}")
+    return _disk_cache
+
+
+def save_enhanced_cache() -> None:
+    """Persist the enhancement cache if it gained entries (runs at exit)."""
+    global _disk_cache_dirty
+    with _disk_cache_lock:
+        if not _disk_cache_dirty:
+            return
+        tmp = ENHANCED_CACHE_PATH.with_suffix(".tmp")
+        tmp.write_bytes(orjson.dumps(
+            {"model": GEMINI_MODEL, "queries": _disk_cache},
+            option=orjson.OPT_INDENT_2
+        ))
+        os.replace(tmp, ENHANCED_CACHE_PATH)
+        _disk_cache_dirty = False
+
+
+atexit.register(save_enhanced_cache)
+
+
+def get_cached_enhancement(query: str) -> Optional[str]:
+    """Return the persisted enhancement for a query text, if any."""
+    with _disk_cache_lock:
+        return _load_disk_cache().get(query)
+
+
+def seed_enhancements(entries: Dict[str, str]) -> int:
+    """
+    Load known enhancements into the cache, replacing existing entries.
 
+    Lets a checked-in set of enhancements take precedence over earlier
+    Gemini output, so evaluation runs are reproducible.
+
+    Args:
+        entries: Query text → enhanced text
+
+    Returns:
+        Number of cache entries added or changed
+    """
+    global _disk_cache_dirty
+    with _disk_cache_lock:
+        cache = _load_disk_cache()
+        changed = {q: e for q, e in entries.items() if cache.get(q) != e}
+        cache.update(changed)
+        if changed:
+            _disk_cache_dirty = True
+    return len(changed)
+
+
+def _store_enhancement(query: str, enhanced: str) -> None:
+    """Record an enhancement; written to disk by save_enhanced_cache()."""
+    global _disk_cache_dirty
+    with _disk_cache_lock:
+        _load_disk_cache()[query] = enhanced
+        _disk_cache_dirty = True
+
+
+def _get_genai_client():
+    """Return the Gemini client for the current GEMINI_API_KEY."""
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise RuntimeError(
             "GEMINI_API_KEY not found. Please set it in your .env file."
         )
-    return genai.Client(api_key=api_key)
+    return _client_for_key(api_key)
+
+
+@functools.lru_cache(maxsize=1)
+def _client_for_key(api_key: str):
+    """Create one client per key (the web app can change the key at runtime)."""
+    from google import genai
+
+    return genai.Client(api_key=api_key, http_options=http_options())
+
+
+def check_gemini() -> None:
+    """Make a minimal live Gemini request; raises if the key or model is invalid."""
+    _get_genai_client().models.generate_content(model=GEMINI_MODEL, contents="test")
+
+
+# System prompt and few-shot examples: identical for every request
+_PREFIX_CONTENTS = [
+    {"role": "user", "parts": [{"text": ENHANCE_SYSTEM_PROMPT}]},
+    *ENHANCE_FEW_SHOT_TURNS,
+]
 
 
 def _build_contents(user_query: str) -> list:
@@ -33,44 +138,84 @@ def _build_contents(user_query: str) -> list:
     Returns:
         List of message contents for Gemini
     """
-    contents = [{"role": "user", "parts": [{"text": ENHANCE_SYSTEM_PROMPT}]}]
-
-    # Add few-shot examples
-    for q, a in ENHANCE_FEW_SHOTS:
-        contents.append({"role": "user", "parts": [{"text": q}]})
-        contents.append({"role": "model", "parts": [{"text": a}]})
+    return _PREFIX_CONTENTS + [{"role": "user", "parts": [{"text": user_query}]}]
 
-    # Add actual query
-    contents.append({"role": "user", "parts": [{"text": user_query}]})
 
-    return contents
-
-
-def enhance_query(query: str) -> str:
+def enhance_query(query: str, limiter: Optional[RateLimiter] = None) -> str:
     """
     Enhance a user query into a descriptive sentence for better image search.
 
     The enhanced query starts with the original text and adds visual details
-    that might appear in matching images.
+    that might appear in matching images. Results are memoized per query
+    text in memory and persisted under QUERY_CACHE_DIR across restarts;
+    the original query returned for an empty response is not cached.
 
     Args:
         query: Original user query
+        limiter: Rate limiter to wait on before a Gemini request (bulk callers
+            pass ratelimit.gemini_limiter; interactive calls are not paced)
 
     Returns:
         Enhanced query with additional visual context
     """
+    cached = get_cached_enhancement(query)
+    if cached is not None:
+        return cached
+
     client = _get_genai_client()
     contents = _build_contents(query)
 
+    if limiter is not None:
+        limiter.acquire()
     resp = client.models.generate_content(
         model=GEMINI_MODEL,
         contents=contents,
         config={"temperature": 0.1}  # Low temperature for more literal output
     )
+    enhanced = _first_sentence(resp)
+    if enhanced is None:
+        return query.strip()
+    _store_enhancement(query, enhanced)
+    return enhanced
+
+
+async def enhance_query_async(query: str) -> str:
+    """
+    Async version of enhance_query using the Gemini asyncio client.
+
+    Shares enhance_query's persistent cache, so queries enhanced by
+    prepare-cache are reused by the CLI, the web app and evaluation.
+
+    Args:
+        query: Original user query
+
+    Returns:
+        Enhanced query with additional visual context
+    """
+    cached = get_cached_enhancement(query)
+    if cached is not None:
+        return cached
+
+    client = _get_genai_client()
+    contents = _build_contents(query)
+
+    resp = await client.aio.models.generate_content(
+        model=GEMINI_MODEL,
+        contents=contents,
+        config={"temperature": 0.1}  # Low temperature for more literal output
+    )
+    enhanced = _first_sentence(resp)
+    if enhanced is None:
+        return query.strip()
+    _store_enhancement(query, enhanced)
+    return enhanced
+
 
+def _first_sentence(resp) -> Optional[str]:
+    """Reduce a Gemini response to one sentence (None if it has no text)."""
     text = (getattr(resp, "text", None) or "").strip()
     if not text:
-        return query.strip()
+        return None
 
     # Take only first line, remove quotes
     out = text.split("\n")[0].strip().strip(" \"'")
@@ -81,7 +226,7 @@ def enhance_query(query: str) -> str:
         if parts:
             out = parts[0]
 
-    return out
+    return out or None
 
 
 def load_enhanced_db(path: str = "data/queries/enhanced_queries.json") -> Dict[str, str]:
@@ -99,7 +244,7 @@ def load_enhanced_db(path: str = "data/queries/enhanced_queries.json") -> Dict[s
 
     if not os.path.exists(path):
         raise RuntimeError(
-            f"{path} not found. Run scripts/prepare_cache.py first "
+            f"{path} not found. Run prepare-cache first "
             "to generate enhanced queries."
         )
     with open(path, "r") as f:
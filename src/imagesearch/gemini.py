@@ -0,0 +1,26 @@
+"""Shared Gemini client settings."""
+
+from __future__ import annotations
+import importlib.util
+
+
+def http_options():
+    """
+    HTTP settings for the Gemini client's connection pools.
+
+    Keeps enough keep-alive connections for concurrent requests so TLS
+    sessions are reused, and multiplexes over HTTP/2 when h2 is installed.
+    Returns None on SDK versions without client_args support.
+    """
+    import httpx
+    from google.genai import types
+
+    if "async_client_args" not in getattr(types.HttpOptions, "model_fields", {}):
+        return None
+
+    limits = httpx.Limits(max_connections=16, max_keepalive_connections=16)
+    http2 = importlib.util.find_spec("h2") is not None
+    return types.HttpOptions(
+        client_args={"limits": limits, "http2": http2},
+        async_client_args={"limits": limits, "http2": http2},
+    )
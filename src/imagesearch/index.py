@@ -1,15 +1,32 @@
 """Pinecone vector index management for image search."""
 
 from __future__ import annotations
-import glob
+import hashlib
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Deque, List, Dict, Any, Optional
 
+import numpy as np
 from pinecone import Pinecone, ServerlessSpec
 
-from .config import INDEX_NAME, PINECONE_CLOUD, PINECONE_REGION, REDUCE_DIM, PROJECT_ROOT
-from .embeddings import encode_image, encode_images, encode_text_to_index, file_id
+from .config import (
+    INDEX_NAME,
+    PINECONE_CLOUD,
+    PINECONE_REGION,
+    PINECONE_POOL_THREADS,
+    REDUCE_DIM,
+    PROJECT_ROOT,
+)
+from .embeddings import (
+    encode_image,
+    encode_image_from_bytes,
+    encode_images,
+    encode_text_to_index,
+    encode_texts_to_index,
+    file_id,
+)
 
 
 # Initialize Pinecone client
@@ -36,7 +53,14 @@ if INDEX_NAME not in {ix.name for ix in pc.list_indexes()}:
         spec=ServerlessSpec(cloud=PINECONE_CLOUD, region=PINECONE_REGION),
     )
 
-index = pc.Index(INDEX_NAME)
+# pool_threads sizes the client's thread pool used by async_req requests
+index = pc.Index(INDEX_NAME, pool_threads=PINECONE_POOL_THREADS)
+
+# File types picked up by upsert_dir
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+# Upsert requests allowed in flight before upsert_many waits on the oldest
+MAX_INFLIGHT_UPSERTS = 4
 
 
 def _to_relative_path(path: str) -> str:
@@ -73,19 +97,27 @@ def _to_absolute_path(path: str) -> str:
     return str(PROJECT_ROOT / path)
 
 
-def upsert_one(path: str) -> str:
+def upsert_one(path: str, data: Optional[bytes] = None) -> str:
     """
     Insert or update a single image in the index.
 
     Args:
-        path: Path to the image file
+        path: Path to the image file (stored as metadata)
+        data: The file's contents, if already in memory; the file is then
+            not read again for encoding or hashing
 
     Returns:
         Vector ID (file hash)
     """
-    vec = encode_image(path)
-    vid = file_id(path)
+    if data is None:
+        vec = encode_image(path)
+        vid = file_id(path)
+    else:
+        vec = encode_image_from_bytes(data)
+        vid = hashlib.sha1(data).hexdigest()  # same ID as file_id(path)
     rel_path = _to_relative_path(path)
+    # The client converts arrays with tolist() itself; it is the fastest
+    # ndarray -> list conversion (array.array round-trips are ~8x slower)
     index.upsert([{
         "id": vid,
         "values": vec.tolist(),
@@ -94,43 +126,107 @@ def upsert_one(path: str) -> str:
     return vid
 
 
-def upsert_dir(folder: str, batch_size: int = 16) -> int:
+def upsert_dir(
+    folder: str,
+    batch_size: int = 16,
+    num_workers: Optional[int] = None
+) -> int:
     """
     Insert or update all images in a directory.
 
     Args:
         folder: Path to the directory containing images
         batch_size: Number of images to process in each batch
+        num_workers: Threads used to decode images (default: CPU count)
 
     Returns:
         Total number of images upserted
     """
-    patterns = ("*.jpg", "*.jpeg", "*.png", "*.JPG", "*.JPEG", "*.PNG")
-    files = sorted({
-        p for pat in patterns
-        for p in glob.glob(os.path.join(folder, pat))
-    })
+    # Single directory scan; extensions compared case-insensitively
+    with os.scandir(folder) as it:
+        files = sorted(
+            e.path for e in it
+            if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTENSIONS
+        )
 
     if not files:
         print(f"No image files found in {folder}")
         return 0
 
-    total = 0
-    for i in range(0, len(files), batch_size):
-        group = files[i:i + batch_size]
-        embs = encode_images(group, batch_size=batch_size)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    return len(upsert_many(files, batch_size=batch_size, num_workers=num_workers))
+
+
+def upsert_many(
+    paths: List[str],
+    batch_size: int = 100,
+    ids: Optional[List[str]] = None,
+    num_workers: int = 1,
+    data: Optional[List[bytes]] = None
+) -> List[str]:
+    """
+    Insert or update many images in the index.
+
+    Images are encoded batch_size at a time and each batch is sent as one
+    upsert request. Requests run asynchronously on the client's thread pool,
+    so uploading a batch overlaps with encoding the next one; at most
+    MAX_INFLIGHT_UPSERTS requests are outstanding at a time.
+
+    Args:
+        paths: Paths to the image files
+        batch_size: Number of images to encode and upsert per request
+        ids: Precomputed vector IDs for paths (computed with file_id if None)
+        num_workers: Threads used to decode each batch of images
+        data: Contents of the files, aligned with paths, if already in
+            memory (images are then decoded and hashed without reading disk)
+
+    Returns:
+        Vector IDs (file hashes) in the same order as paths
+    """
+    if ids is None and data is not None:
+        ids = [hashlib.sha1(d).hexdigest() for d in data]
+    if ids is None:
+        # Hashing is I/O-bound (hashlib releases the GIL), so do it up front in parallel
+        if num_workers > 1:
+            with ThreadPoolExecutor(max_workers=num_workers) as ex:
+                ids = list(ex.map(file_id, paths))
+        else:
+            ids = [file_id(p) for p in paths]
+    vids = list(ids)
+
+    pending: Deque = deque()
+    sent = 0
+
+    def wait_oldest() -> None:
+        nonlocal sent
+        request, count = pending.popleft()
+        request.get()  # raises if the upsert failed
+        sent += 1
+        print(f"Upserted batch {sent}: {count} images")
+
+    for i in range(0, len(paths), batch_size):
+        group = paths[i:i + batch_size]
+        sources = group if data is None else data[i:i + batch_size]
+        embs = encode_images(sources, batch_size=batch_size, num_workers=num_workers)
+        # One tolist() for the whole batch instead of one per row
+        values = embs.astype(np.float32, copy=False).tolist()
 
         upserts = [{
-            "id": file_id(p),
-            "values": e.tolist(),
+            "id": vid,
+            "values": v,
             "metadata": {"path": _to_relative_path(p)}
-        } for p, e in zip(group, embs)]
+        } for vid, p, v in zip(vids[i:i + batch_size], group, values)]
+
+        # Block before encoding further ahead than the upload can keep up with
+        if len(pending) >= MAX_INFLIGHT_UPSERTS:
+            wait_oldest()
+        pending.append((index.upsert(vectors=upserts, async_req=True), len(upserts)))
 
-        index.upsert(upserts)
-        total += len(upserts)
-        print(f"Upserted batch {i // batch_size + 1}: {len(upserts)} images")
+    while pending:
+        wait_oldest()
 
-    return total
+    return vids
 
 
 def delete_by_path(path: str) -> None:
@@ -143,6 +239,23 @@ def delete_by_path(path: str) -> None:
     index.delete(filter={"path": {"$eq": path}})
 
 
+def _query_vector(vec, top_k: int) -> List[Dict[str, Any]]:
+    """Query the index with an embedding and convert stored paths to absolute."""
+    res = index.query(
+        vector=vec.tolist(),
+        top_k=top_k,
+        include_metadata=True
+    )
+    matches = res.get("matches", [])
+
+    # Convert relative paths back to absolute paths
+    for match in matches:
+        if "metadata" in match and "path" in match["metadata"]:
+            match["metadata"]["path"] = _to_absolute_path(match["metadata"]["path"])
+
+    return matches
+
+
 def search(query: str, top_k: int) -> List[Dict[str, Any]]:
     """
     Search for images matching a text query.
@@ -154,20 +267,40 @@ def search(query: str, top_k: int) -> List[Dict[str, Any]]:
     Returns:
         List of matches with id, score, and metadata (paths are converted to absolute)
     """
-    q = encode_text_to_index(query)
-    res = index.query(
-        vector=q.tolist(),
-        top_k=top_k,
-        include_metadata=True
-    )
-    matches = res.get("matches", [])
+    return _query_vector(encode_text_to_index(query), top_k)
 
-    # Convert relative paths back to absolute paths
-    for match in matches:
-        if "metadata" in match and "path" in match["metadata"]:
-            match["metadata"]["path"] = _to_absolute_path(match["metadata"]["path"])
 
-    return matches
+def search_many(
+    queries: Dict[str, int],
+    max_workers: int = 16
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Search for many text queries at once.
+
+    All query texts are encoded in a single batch and the Pinecone requests
+    are issued concurrently, so network round-trips overlap instead of
+    adding up.
+
+    Args:
+        queries: Mapping of query text to the number of results to fetch
+        max_workers: Maximum number of concurrent Pinecone requests
+
+    Returns:
+        Mapping of query text to its list of matches (paths are converted to absolute)
+    """
+    if not queries:
+        return {}
+
+    texts = list(queries)
+    vecs = encode_texts_to_index(texts)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        results = ex.map(
+            lambda text, vec: _query_vector(vec, queries[text]),
+            texts,
+            vecs
+        )
+        return dict(zip(texts, results))
 
 
 def stats() -> Dict[str, Any]:
@@ -0,0 +1,107 @@
+"""ONNX Runtime CLIP backend for CPU inference.
+
+Used instead of sentence-transformers when CLIP_ONNX_DIR is set and no GPU
+is available. The directory must contain:
+
+- visual.onnx: pixel_values (N, 3, 224, 224) -> projected image embeddings
+- textual.onnx: input_ids, attention_mask (N, L) -> projected text embeddings
+- the CLIP tokenizer and image processor files
+- optionally export.json with the weight precision ("fp32" or "int8")
+
+scripts/export_clip_onnx.py writes such a directory.
+"""
+
+from __future__ import annotations
+import json
+import os
+from typing import List, Union
+
+import numpy as np
+from PIL import Image
+
+
+class OnnxClip:
+    """
+    Minimal stand-in for SentenceTransformer.encode backed by ONNX Runtime.
+
+    Accepts the same inputs the rest of the package passes to the
+    sentence-transformers CLIP model: a PIL image, a string, or a list of
+    either (not mixed).
+    """
+
+    def __init__(self, model_dir: str):
+        import onnxruntime as ort
+        from transformers import CLIPImageProcessor, CLIPTokenizerFast
+
+        # OpenVINO is used when onnxruntime-openvino is installed
+        available = ort.get_available_providers()
+        providers = [
+            p for p in ("OpenVINOExecutionProvider", "CPUExecutionProvider")
+            if p in available
+        ]
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self._visual = ort.InferenceSession(
+            os.path.join(model_dir, "visual.onnx"), opts, providers=providers
+        )
+        self._textual = ort.InferenceSession(
+            os.path.join(model_dir, "textual.onnx"), opts, providers=providers
+        )
+        self._processor = CLIPImageProcessor.from_pretrained(model_dir)
+        self._tokenizer = CLIPTokenizerFast.from_pretrained(model_dir)
+
+        # Embedding size from the exported graph's output shape (batch, dim)
+        self.dim = int(self._visual.get_outputs()[0].shape[-1])
+
+        # Weight precision recorded by the exporter (older exports: float32)
+        self.precision = "fp32"
+        meta_path = os.path.join(model_dir, "export.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.precision = json.load(f).get("precision", "fp32")
+
+    def _encode_batch(self, batch: list) -> np.ndarray:
+        if isinstance(batch[0], Image.Image):
+            pixels = self._processor(images=batch, return_tensors="np")["pixel_values"]
+            return self._visual.run(None, {"pixel_values": pixels.astype(np.float32)})[0]
+
+        tok = self._tokenizer(
+            batch, padding=True, truncation=True, max_length=77, return_tensors="np"
+        )
+        return self._textual.run(None, {
+            "input_ids": tok["input_ids"].astype(np.int64),
+            "attention_mask": tok["attention_mask"].astype(np.int64),
+        })[0]
+
+    def encode(
+        self,
+        inputs: Union[Image.Image, str, List[Union[Image.Image, str]]],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+    ) -> np.ndarray:
+        """
+        Encode images or texts into CLIP embeddings.
+
+        Args:
+            inputs: A PIL image, a string, or a list of either
+            batch_size: Number of inputs per ONNX Runtime call
+            convert_to_numpy: Accepted for compatibility (always NumPy)
+            normalize_embeddings: L2-normalize the embeddings
+
+        Returns:
+            Embeddings of shape (N, D), or (D,) for a single input
+        """
+        single = not isinstance(inputs, list)
+        items = [inputs] if single else inputs
+        if not items:
+            return np.empty((0, self.dim), dtype=np.float32)
+
+        embs = np.concatenate([
+            self._encode_batch(items[i:i + batch_size])
+            for i in range(0, len(items), batch_size)
+        ]).astype(np.float32, copy=False)
+        if normalize_embeddings:
+            embs /= np.linalg.norm(embs, axis=1, keepdims=True) + 1e-12
+        return embs[0] if single else embs
@@ -0,0 +1,42 @@
+"""Request rate limiting for external APIs."""
+
+from __future__ import annotations
+import threading
+import time
+
+from .config import GEMINI_RPM
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket.
+
+    Up to max_calls requests may be made in a burst; capacity refills
+    continuously at max_calls per period seconds, and acquire() only sleeps
+    when the bucket is empty.
+    """
+
+    def __init__(self, max_calls: int, period: float = 60.0):
+        self.capacity = float(max_calls)
+        self.rate = max_calls / period
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a request may be made, then consume one token."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Process-wide Gemini budget; bulk callers pass it to describe_image and
+# enhance_query (interactive requests are not paced)
+gemini_limiter = RateLimiter(GEMINI_RPM, 60.0)
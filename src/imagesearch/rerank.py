@@ -1,19 +1,108 @@
 """Caption-based reranking for improved search results."""
 
 from __future__ import annotations
-from typing import List, Dict, Any, Callable
+from typing import List, Dict, Any, Callable, Optional, Tuple
 
 import numpy as np
 
-from .embeddings import encode_text_clip, encode_texts_clip
+from .caption import get_cached_embs, put_cached_embs
+from .embeddings import CLIP_CACHE_TAG, encode_text_clip, encode_texts_clip
 
 
-def rerank_by_caption(
+def _caption_embeddings(keys: List[str], captions: List[str]) -> np.ndarray:
+    """
+    CLIP text embeddings of captions, reusing ones stored in the caption cache.
+
+    Only captions without a stored embedding are encoded; those are stored
+    for the next search.
+    """
+    stored = get_cached_embs(keys, captions, CLIP_CACHE_TAG)
+    rows = [stored.get(k) for k in keys]
+    missing = [i for i, row in enumerate(rows) if row is None]
+
+    if missing:
+        miss_keys = [keys[i] for i in missing]
+        miss_caps = [captions[i] for i in missing]
+        embs = encode_texts_clip(miss_caps)
+        for i, emb in zip(missing, embs):
+            rows[i] = emb
+        try:
+            put_cached_embs(miss_keys, miss_caps, embs, CLIP_CACHE_TAG)
+        except Exception as e:
+            print(f"[Rerank] Could not store caption embeddings: {e}")
+    return np.stack(rows).astype(np.float32, copy=False)
+
+
+def score_components(
     query: str,
     matches: List[Dict[str, Any]],
     get_caption: Callable[[str], str],
+    query_embedding: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Compute the per-match scores that reranking blends together.
+
+    The components do not depend on the blend weight, so callers comparing
+    several alpha values can compute them once and blend each alpha cheaply
+    with blend_scores.
+
+    Args:
+        query: Text query
+        matches: Initial search results from Pinecone with keys: id, score, metadata
+        get_caption: Function to retrieve caption for an image path
+        query_embedding: Precomputed encode_text_clip(query), if available
+
+    Returns:
+        Tuple of (orig_scores, caption_sims, captions), aligned with matches
+    """
+    # Extract paths and get captions
+    paths = [m["metadata"].get("path", "") for m in matches]
+    captions = [get_caption(p) if p else "" for p in paths]
+
+    # Compute caption similarities in full CLIP text space (512-d)
+    q = encode_text_clip(query) if query_embedding is None else query_embedding  # (512,)
+    caps = _caption_embeddings([m["id"] for m in matches], captions)  # (K, 512)
+    cap_sims = (caps @ q).astype(np.float64)  # Cosine similarity (already normalized)
+
+    orig = np.fromiter(
+        (m.get("score", 0.0) for m in matches), dtype=np.float64, count=len(matches)
+    )
+    return orig, cap_sims, captions
+
+
+def blend_scores(
+    orig_scores: np.ndarray,
+    caption_sims: np.ndarray,
     alpha: float = 0.6,
     use_blend: bool = True
+) -> np.ndarray:
+    """
+    Blend original retrieval scores with caption similarities.
+
+    Args:
+        orig_scores: Original Pinecone scores in [0, 1]
+        caption_sims: Caption similarities in [-1, 1]
+        alpha: Blend weight for caption similarity (0.0 = only orig score, 1.0 = only caption)
+        use_blend: If True, blend original and caption scores. If False, use only caption score.
+
+    Returns:
+        Final scores, aligned with the inputs
+    """
+    if not use_blend:
+        # Pure caption-based ranking
+        return caption_sims
+
+    # Rescale original score from [0, 1] to [-1, 1] for blending
+    return (1.0 - alpha) * (2.0 * orig_scores - 1.0) + alpha * caption_sims
+
+
+def rerank_by_caption(
+    query: str,
+    matches: List[Dict[str, Any]],
+    get_caption: Callable[[str], str],
+    alpha: float = 0.6,
+    use_blend: bool = True,
+    query_embedding: Optional[np.ndarray] = None
 ) -> List[Dict[str, Any]]:
     """
     Rerank search results using caption similarity in CLIP text space.
@@ -28,6 +117,7 @@ def rerank_by_caption(
         get_caption: Function to retrieve caption for an image path
         alpha: Blend weight for caption similarity (0.0 = only orig score, 1.0 = only caption)
         use_blend: If True, blend original and caption scores. If False, use only caption score.
+        query_embedding: Precomputed encode_text_clip(query), if available
 
     Returns:
         List of reranked results sorted by final_score (descending)
@@ -35,37 +125,17 @@ def rerank_by_caption(
     if not matches:
         return []
 
-    # Extract paths and get captions
-    paths = [m["metadata"].get("path", "") for m in matches]
-    captions = [get_caption(p) if p else "" for p in paths]
+    orig, cap_sims, captions = score_components(query, matches, get_caption, query_embedding)
+    final = blend_scores(orig, cap_sims, alpha=alpha, use_blend=use_blend)
 
-    # Compute caption similarities in full CLIP text space (768-d)
-    q = encode_text_clip(query)  # (768,)
-    caps = encode_texts_clip(captions)  # (K, 768)
-    cap_sims = caps @ q  # Cosine similarity (already normalized)
-
-    # Compute final scores
-    out = []
-    for m, cap, cs in zip(matches, captions, cap_sims):
-        orig = float(m.get("score", 0.0))
-
-        if use_blend:
-            # Rescale original score from [0, 1] to [-1, 1] for blending
-            orig_rescaled = (2.0 * orig) - 1.0
-            final = (1.0 - alpha) * orig_rescaled + alpha * float(cs)
-        else:
-            # Pure caption-based ranking
-            final = float(cs)
-
-        out.append({
-            "final_score": final,
-            "orig_score": orig,
-            "caption_sim": float(cs),
-            "path": m["metadata"].get("path", ""),
-            "id": m["id"],
-            "caption": cap,
-        })
-
-    # Sort by final score (descending)
-    out.sort(key=lambda r: r["final_score"], reverse=True)
-    return out
\ No newline at end of file
+    # Sort by final score (descending; stable, so ties keep retrieval order)
+    order = np.argsort(-final, kind="stable").tolist()
+    final_l, orig_l, sims_l = final.tolist(), orig.tolist(), cap_sims.tolist()
+    return [{
+        "final_score": final_l[i],
+        "orig_score": orig_l[i],
+        "caption_sim": sims_l[i],
+        "path": matches[i]["metadata"].get("path", ""),
+        "id": matches[i]["id"],
+        "caption": captions[i],
+    } for i in order]
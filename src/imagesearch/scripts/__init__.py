@@ -0,0 +1 @@
+"""Maintenance commands installed as console scripts."""
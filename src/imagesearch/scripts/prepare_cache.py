@@ -0,0 +1,410 @@
+"""
+Prepare cache files for captions and enhanced queries.
+
+This script pre-generates:
+1. Image captions using Gemini vision API
+2. Enhanced queries using Gemini text API
+
+Results are cached to avoid repeated API calls during evaluation/search.
+Requests run concurrently with rate limiting to respect free-tier API limits.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Set, Tuple, List, TypeVar
+
+import orjson
+from aiolimiter import AsyncLimiter
+
+from ..config import GEMINI_RPM
+from ..embeddings import file_id
+from ..caption import cached_keys, describe_image_async, get_cached, put_cached
+from ..enhance import enhance_query_async
+
+
+# Default locations, relative to the working directory (run from the
+# project root, or pass --images-dir/--data-dir)
+IMAGES_DIR = "example_images"
+DATA_DIR = "data"
+CAPTION_DB_NAME = os.path.join("captions", "captions.json")
+ENHANCED_DB_NAME = os.path.join("queries", "enhanced_queries.json")
+QUERIES_SPEC_NAME = os.path.join("queries", "queries.json")
+
+# Rate limiting (for Gemini free tier, set GEMINI_RPM to change)
+MAX_CALLS_PER_BATCH = GEMINI_RPM  # calls per minute
+MAX_CONCURRENT_CALLS = 5
+
+# Persist progress (to shard files) every N new results or every few seconds
+FLUSH_EVERY = 32
+FLUSH_INTERVAL = 5.0
+
+T = TypeVar("T")
+
+
+# Utility functions
+def load_json(path: str) -> Dict[str, str]:
+    """
+    Load JSON file or return empty dict if not found.
+
+    Entries left in shard files by an interrupted run are merged in.
+    """
+    data = orjson.loads(Path(path).read_bytes()) if os.path.exists(path) else {}
+    shard_dir = _shard_dir(path)
+    if os.path.isdir(shard_dir):
+        with os.scandir(shard_dir) as it:
+            for e in sorted(it, key=lambda e: e.name):
+                if e.name.endswith(".json"):
+                    data.update(orjson.loads(Path(e.path).read_bytes()))
+    return data
+
+
+def save_json(path: str, data: Dict[str, str]) -> None:
+    """Save data to JSON file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Path(path).write_bytes(
+        orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+    )
+
+
+def _shard_dir(path: str) -> str:
+    """Directory holding the write-ahead shards of a JSON database."""
+    return path + ".shards"
+
+
+def _shard_of(key: str) -> str:
+    """Shard name for a key: the first two hex digits of its hash."""
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:2]
+
+
+class JsonFlusher:
+    """
+    Persist a JSON database periodically instead of after every update.
+
+    Callers mark() the keys they set; periodic flushes only rewrite the
+    shard files (one per two-hex-digit key hash) those keys map to, so
+    their cost does not grow with the database. compact() merges
+    everything back into the single JSON file that readers use and
+    removes the shards.
+    """
+
+    def __init__(self, path: str, data: Dict[str, str]):
+        self.path = path
+        self.data = data
+        self._shards: Dict[str, Dict[str, str]] = {}
+        self._dirty: Set[str] = set()
+        self._last_flush = time.monotonic()
+
+    def mark(self, keys: Iterable[str]) -> None:
+        """Record keys set in data; flush if enough keys or time accumulated."""
+        self._dirty.update(keys)
+        if (len(self._dirty) >= FLUSH_EVERY
+                or time.monotonic() - self._last_flush > FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the shards that the marked keys map to."""
+        dirty_shards = set()
+        for key in self._dirty:
+            shard = _shard_of(key)
+            self._shards.setdefault(shard, {})[key] = self.data[key]
+            dirty_shards.add(shard)
+
+        shard_dir = _shard_dir(self.path)
+        for shard in dirty_shards:
+            save_json(os.path.join(shard_dir, f"{shard}.json"), self._shards[shard])
+        self._dirty.clear()
+        self._last_flush = time.monotonic()
+
+    def compact(self) -> None:
+        """Write the full database file and drop the shards."""
+        self.flush()
+        shard_dir = _shard_dir(self.path)
+        if self._shards or os.path.isdir(shard_dir) or not os.path.exists(self.path):
+            save_json(self.path, self.data)
+            shutil.rmtree(shard_dir, ignore_errors=True)
+            self._shards.clear()
+
+
+# Caption generation
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def list_all_images(images_dir: str) -> List[str]:
+    """Find all images in directory (single scan, case-insensitive extensions)."""
+    with os.scandir(images_dir) as it:
+        return sorted(
+            e.path for e in it
+            if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTENSIONS
+        )
+
+
+def get_image_stem(path: str) -> str:
+    """Extract filename without extension."""
+    base = os.path.basename(path)
+    stem, _ = os.path.splitext(base)
+    return stem
+
+
+def caption_needs_work(path: str, caption_db: Dict[str, str]) -> bool:
+    """Check if the caption database has no caption for this image yet."""
+    stem = get_image_stem(path)
+    return not caption_db.get(stem)
+
+
+def plan_captions(
+    paths: List[str],
+    caption_db: Dict[str, str]
+) -> Dict[str, List[str]]:
+    """
+    Group images without a caption by content hash.
+
+    Images whose hash is already in the caption cache get their database
+    entry filled from it. Byte-identical copies share a single hash, so
+    each group needs only one API call.
+
+    Returns:
+        Dictionary mapping file ID to the paths still needing that caption
+    """
+    cached = cached_keys()
+    groups: Dict[str, List[str]] = {}
+    for path in paths:
+        fid = file_id(path)
+        cached_cap = get_cached(fid) if fid in cached else None
+        if cached_cap:
+            caption_db[get_image_stem(path)] = cached_cap
+        else:
+            groups.setdefault(fid, []).append(path)
+    return groups
+
+
+def store_caption_for_images(
+    fid: str,
+    paths: List[str],
+    caption: str,
+    caption_db: Dict[str, str]
+) -> None:
+    """Store caption in the cache once and in the database for every copy."""
+    put_cached(fid, caption)
+    for path in paths:
+        caption_db[get_image_stem(path)] = caption
+
+
+async def run_limited(
+    items: List[T],
+    call: Callable[[T], Awaitable],
+) -> AsyncIterator[tuple]:
+    """
+    Run call(item) for all items concurrently under the API limits.
+
+    At most MAX_CONCURRENT_CALLS requests are in flight and at most
+    MAX_CALLS_PER_BATCH start per minute.
+
+    Yields:
+        (item, result, error) tuples in completion order; error is None
+        on success and result is None on failure
+    """
+    sem = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
+    limiter = AsyncLimiter(MAX_CALLS_PER_BATCH, 60)
+
+    async def _one(item: T):
+        async with sem:
+            async with limiter:
+                try:
+                    return item, await call(item), None
+                except Exception as e:
+                    return item, None, e
+
+    for fut in asyncio.as_completed([_one(item) for item in items]):
+        yield await fut
+
+
+async def _generate_captions(groups: Dict[str, List[str]], flusher: JsonFlusher) -> int:
+    """Caption one image per group concurrently, persisting progress periodically."""
+    async def _describe(fid: str):
+        return await describe_image_async(groups[fid][0])
+
+    new_captions = 0
+    async for fid, result, err in run_limited(list(groups), _describe):
+        img_path = groups[fid][0]
+        if err is not None:
+            print(f"[Captions] Error processing {img_path}: {err}")
+            continue
+
+        cap_text, _usage = result
+        store_caption_for_images(fid, groups[fid], cap_text, flusher.data)
+        new_captions += 1
+        print(f"[Captions] Processed {img_path}")
+
+        # Persist incrementally
+        flusher.mark(get_image_stem(p) for p in groups[fid])
+
+    return new_captions
+
+
+def generate_missing_captions(images_dir: str, db_path: str) -> None:
+    """
+    Generate captions for all images that don't have them yet.
+    Includes rate limiting and progress persistence.
+
+    Args:
+        images_dir: Directory containing the images
+        db_path: Caption database JSON file to fill in
+    """
+    caption_db = load_json(db_path)
+    all_imgs = list_all_images(images_dir)
+
+    print(f"[Captions] Found {len(all_imgs)} images in {images_dir}")
+
+    todo = [p for p in all_imgs if caption_needs_work(p, caption_db)]
+    flusher = JsonFlusher(db_path, caption_db)
+    try:
+        groups = plan_captions(todo, caption_db) if todo else {}
+        # Entries filled from the caption cache
+        flusher.mark(get_image_stem(p) for p in todo if not caption_needs_work(p, caption_db))
+        if not groups:
+            print("[Captions] All images already captioned.")
+            return
+
+        n_missing = sum(len(paths) for paths in groups.values())
+        print(f"[Captions] {n_missing} images need captions "
+              f"({len(groups)} unique by content)")
+        new_captions = asyncio.run(_generate_captions(groups, flusher))
+    finally:
+        flusher.compact()
+
+    print(f"[Captions] Done. {new_captions} new captions generated.")
+
+
+# Enhanced query generation
+def load_queries_spec(spec_path: str) -> Dict[str, dict]:
+    """Load queries specification file."""
+    return orjson.loads(Path(spec_path).read_bytes())
+
+
+def enhanced_query_needs_work(q_id: str, enhanced_db: Dict[str, str]) -> bool:
+    """Check if enhanced query already exists."""
+    return q_id not in enhanced_db or not enhanced_db[q_id]
+
+
+def store_enhanced_query(
+    q_id: str,
+    enhanced_text: str,
+    enhanced_db: Dict[str, str]
+) -> None:
+    """Store enhanced query in database."""
+    enhanced_db[q_id] = enhanced_text
+
+
+async def _generate_enhanced_queries(
+    todo: List[Tuple[str, str]],
+    flusher: JsonFlusher
+) -> int:
+    """Enhance todo queries concurrently, persisting progress periodically."""
+    async def _enhance(item: Tuple[str, str]) -> str:
+        return await enhance_query_async(item[1])
+
+    new_queries = 0
+    async for (q_id, q_text), enhanced_text, err in run_limited(todo, _enhance):
+        if err is not None:
+            print(f"[Enhance] Error processing {q_id}: {err}")
+            continue
+
+        store_enhanced_query(q_id, enhanced_text, flusher.data)
+        new_queries += 1
+        print(f"[Enhance] Processed {q_id}: \"{q_text}\"")
+
+        # Persist incrementally
+        flusher.mark([q_id])
+
+    return new_queries
+
+
+def generate_missing_enhanced_queries(spec_path: str, db_path: str) -> None:
+    """
+    Generate enhanced versions of all queries.
+    Includes rate limiting and progress persistence.
+
+    Args:
+        spec_path: Queries specification JSON file
+        db_path: Enhanced query database JSON file to fill in
+    """
+    if not os.path.exists(spec_path):
+        print(f"[Enhance] Queries spec not found at {spec_path}, skipping.")
+        return
+
+    spec = load_queries_spec(spec_path)
+    enhanced_db = load_json(db_path)
+
+    # Flatten queries
+    todo: List[Tuple[str, str]] = []
+    for bucket in spec.values():
+        q_block = bucket.get("queries", {})
+        for q_id, q_text in q_block.items():
+            todo.append((q_id, q_text))
+
+    print(f"[Enhance] Found {len(todo)} queries")
+
+    todo = [(q_id, q_text) for q_id, q_text in todo
+            if enhanced_query_needs_work(q_id, enhanced_db)]
+    flusher = JsonFlusher(db_path, enhanced_db)
+    try:
+        if not todo:
+            print("[Enhance] All queries already cached.")
+            return
+
+        new_queries = asyncio.run(_generate_enhanced_queries(todo, flusher))
+    finally:
+        flusher.compact()
+
+    print(f"[Enhance] Done. {new_queries} new enhanced queries generated.")
+
+
+# Main
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(
+        description="Pre-generate captions and enhanced queries"
+    )
+    parser.add_argument(
+        "--images-dir", default=IMAGES_DIR,
+        help=f"Images to caption (default: ./{IMAGES_DIR})"
+    )
+    parser.add_argument(
+        "--data-dir", default=DATA_DIR,
+        help=f"Directory holding captions/ and queries/ (default: ./{DATA_DIR})"
+    )
+    args = parser.parse_args()
+
+    caption_db_path = os.path.join(args.data_dir, CAPTION_DB_NAME)
+    enhanced_db_path = os.path.join(args.data_dir, ENHANCED_DB_NAME)
+
+    print("=" * 60)
+    print("Cache Preparation Script")
+    print("=" * 60)
+
+    # Generate captions
+    if os.path.exists(args.images_dir):
+        generate_missing_captions(args.images_dir, caption_db_path)
+    else:
+        print(f"[Warning] Images directory not found: {args.images_dir}")
+
+    # Generate enhanced queries
+    generate_missing_enhanced_queries(
+        os.path.join(args.data_dir, QUERIES_SPEC_NAME), enhanced_db_path
+    )
+
+    print("\n" + "=" * 60)
+    print("Cache preparation complete!")
+    print(f"Captions: {caption_db_path}")
+    print(f"Enhanced queries: {enhanced_db_path}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,18 +1,20 @@
 """Re-index all images in web/uploads/ to update paths to relative format."""
 
 from __future__ import annotations
-import sys
+import argparse
 from pathlib import Path
 
-# Add parent directory to path
-sys.path.insert(0, str(Path(__file__).parent.parent))
-
-from src.imagesearch.index import upsert_dir
+from ..index import upsert_dir
 
 
 def main():
     """Re-index all images in web/uploads/ directory."""
-    uploads_dir = Path(__file__).parent.parent / "web" / "uploads"
+    parser = argparse.ArgumentParser(description="Re-index uploaded images")
+    parser.add_argument(
+        "uploads_dir", nargs="?", default=str(Path("web") / "uploads"),
+        help="Directory to re-index (default: ./web/uploads)"
+    )
+    uploads_dir = Path(parser.parse_args().uploads_dir)
 
     if not uploads_dir.exists():
         print(f"Error: Directory {uploads_dir} does not exist")
@@ -22,7 +24,7 @@ def main():
     print("This will update existing vectors with new relative paths...")
     print()
 
-    total = upsert_dir(str(uploads_dir), batch_size=32)
+    total = upsert_dir(str(uploads_dir), batch_size=32, num_workers=8)
 
     print()
     print(f"✓ Successfully re-indexed {total} images")
@@ -1,6 +1,8 @@
 """Flask web application for Image Search UI."""
 
 from __future__ import annotations
+import functools
+import hashlib
 import os
 import sys
 import json
@@ -18,7 +20,7 @@ from src.imagesearch import index
 from src.imagesearch.embeddings import file_id
 from src.imagesearch.caption import describe_image, get_cached, put_cached
 from src.imagesearch.rerank import rerank_by_caption
-from src.imagesearch.enhance import enhance_query
+from src.imagesearch.enhance import check_gemini, enhance_query
 from src.imagesearch.config import PROJECT_ROOT
 
 # Initialize Flask app
@@ -35,8 +37,37 @@ def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1] in ALLOWED_EXTENSIONS
 
 
+# Uploads are copied in chunks of this size
+UPLOAD_CHUNK = 1 << 20
+
+
+def _save_upload(file, filepath: Path):
+    """
+    Save an upload, hashing it and keeping its bytes in the same pass.
+
+    Returns:
+        Tuple of (data, vector_id); vector_id equals file_id(filepath)
+    """
+    h = hashlib.sha1()
+    chunks = []
+    with open(filepath, 'wb', buffering=UPLOAD_CHUNK) as dest:
+        for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK), b''):
+            dest.write(chunk)
+            h.update(chunk)
+            chunks.append(chunk)
+    return b''.join(chunks), h.hexdigest()
+
+
 def _get_caption_cached(path: str) -> str:
     """Get caption for an image, using cache when available."""
+    # Keyed on mtime/size too: an upload may replace a file under the same name
+    st = os.stat(path)
+    return _caption_for_file(path, st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=8192)
+def _caption_for_file(path: str, mtime_ns: int, size: int) -> str:
+    """Caption lookup memoized per file version (failures are not cached)."""
     key = file_id(path)
     cap = get_cached(key)
     if cap:
@@ -79,8 +110,8 @@ def validate_api_keys():
         errors.append('GEMINI_API_KEY not configured')
     else:
         try:
-            # Try to enhance a test query
-            enhance_query('test')
+            # Make a live request (enhance_query may answer from its cache)
+            check_gemini()
         except Exception as e:
             errors.append(f'Gemini error: {str(e)}')
 
@@ -167,7 +198,7 @@ def upload_files():
     if not files:
         return jsonify({'error': 'No files selected'}), 400
 
-    uploaded_paths = []
+    uploads = []
     errors = []
 
     for file in files:
@@ -176,32 +207,44 @@ def upload_files():
                 filename = secure_filename(file.filename)
                 filepath = app.config['UPLOAD_FOLDER'] / filename
 
-                # Save file
-                file.save(str(filepath))
-                uploaded_paths.append(str(filepath))
+                # Keep the bytes: they are saved for serving and indexed
+                # from memory, so the file is not read back
+                data, vid = _save_upload(file, filepath)
+                uploads.append((str(filepath), data, vid))
 
             except Exception as e:
                 errors.append(f'{file.filename}: {str(e)}')
         elif file and file.filename:
             errors.append(f'{file.filename}: Invalid file type')
 
-    if not uploaded_paths:
+    if not uploads:
         return jsonify({'error': 'No valid images uploaded', 'details': errors}), 400
 
     # Insert images into index
     inserted = 0
     insertion_errors = []
 
-    for path in uploaded_paths:
-        try:
-            index.upsert_one(path)
-            inserted += 1
-        except Exception as e:
-            insertion_errors.append(f'{os.path.basename(path)}: {str(e)}')
+    # Encode and upsert everything in batches; if a batch fails (e.g. one
+    # unreadable image), retry file by file so errors are reported per file
+    try:
+        index.upsert_many(
+            [path for path, _, _ in uploads],
+            batch_size=32,
+            ids=[vid for _, _, vid in uploads],
+            data=[data for _, data, _ in uploads]
+        )
+        inserted = len(uploads)
+    except Exception:
+        for path, data, _ in uploads:
+            try:
+                index.upsert_one(path, data=data)
+                inserted += 1
+            except Exception as e:
+                insertion_errors.append(f'{os.path.basename(path)}: {str(e)}')
 
     result = {
         'success': True,
-        'uploaded': len(uploaded_paths),
+        'uploaded': len(uploads),
         'inserted': inserted,
     }
 